@@ -1,14 +1,38 @@
+import asyncio
+import re
+import time
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Body, WebSocket
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional
 from src.main_logger import logger
 from services.chat import router
 from services.util_services import util_router
+from services.load_chat import stream_router, websocket_endpoint
+from library.sandbox import get_sandbox_pool, shutdown_sandbox_pool
+from library.jobs import start_dataset_workers, stop_dataset_workers
+from library.db_connect import async_engine
+from library.cache_connect import init_redis, close_redis
+from library.metrics import HTTP_DURATION, metrics_payload
+from library.tracing import span, new_trace_id
 
-app = FastAPI()
-IGNORE = ["/ping"]
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_redis()
+    await asyncio.to_thread(get_sandbox_pool)
+    start_dataset_workers()
+    yield
+    await stop_dataset_workers()
+    await asyncio.to_thread(shutdown_sandbox_pool)
+    await async_engine.dispose()
+    await close_redis()
+
+
+app = FastAPI(lifespan=lifespan)
+IGNORE = ["/ping", "/metrics"]
 
 
 app.add_middleware(
@@ -21,9 +45,13 @@ app.add_middleware(
 
 @app.middleware("http")
 async def check_session(request: Request, call_next):
+    request_id = request.headers.get("x-request-id", "")
+    if not re.fullmatch(r"[0-9a-f]{32}", request_id):
+        request_id = new_trace_id()
+    request.state.request_id = request_id
     try:
         path = request.scope["path"]
-        logger.info(f"request received  --> {path}")
+        logger.info(f"request received  --> {path} {request_id=}")
 
         if request.method != "OPTIONS" and path not in IGNORE:
             session_id = request.headers.get("session_id")
@@ -32,24 +60,38 @@ async def check_session(request: Request, call_next):
             logger.info(f"{session_id=}")
             request.state.session_id = session_id
 
-        response = await call_next(request)
+        start = time.perf_counter()
+        with span(f"{request.method} {path}", trace_id=request_id) as _attributes:
+            response = await call_next(request)
+            _attributes["status_code"] = response.status_code
+        response.headers["X-Request-ID"] = request_id
+        _route = request.scope.get("route")
+        HTTP_DURATION.labels(request.method, getattr(_route, "path", "unmatched"),
+                             response.status_code).observe(time.perf_counter() - start)
     except Exception as e:
         logger.exception(f"error in main middleware {e}")
         response = JSONResponse("Unauthorized", status_code=401)
     return response
 
 
-# @app.websocket("/ws/{session_id}")
-# async def ws_endpoint(websocket: WebSocket, session_id: str):
-#     try:
-#         await websocket_endpoint(websocket, session_id)
-#     except Exception as e:
-#         logger.exception(f"error in ws endpoint main {e}")
+@app.websocket("/ws/{session_id}")
+async def ws_endpoint(websocket: WebSocket, session_id: str):
+    try:
+        await websocket_endpoint(websocket, session_id)
+    except Exception as e:
+        logger.exception(f"error in ws endpoint main {e}")
 
 @app.get("/ping")
 async def ping(request: Request):
     return {"message":"service is running"}
 
 
+@app.get("/metrics")
+async def metrics(request: Request):
+    body, content_type = metrics_payload()
+    return Response(content=body, media_type=content_type)
+
+
 app.include_router(router)
 app.include_router(util_router)
+app.include_router(stream_router)
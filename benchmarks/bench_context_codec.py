@@ -0,0 +1,82 @@
+"""
+Compares the legacy json chat context on redis (every langchain message field,
+rebuilt with messages_from_dict) with the context codecs: stored bytes and
+encode / decode time per context.
+
+    python benchmarks/bench_context_codec.py
+    python benchmarks/bench_context_codec.py --turns 2 6 12 --compression none zstd
+
+Contexts look like the output of compact_context: a rolling summary and
+user / final answer turns with tables in the answers.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def build_context(turns):
+    from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+
+    table = "\n".join(f"| product_{i} | {i * 113.5:.2f} | {i * 7} |" for i in range(15))
+    messages = [SystemMessage(content="Conversation summary so far:\n- the user explores sales by region and product")]
+    for i in range(turns):
+        messages.append(HumanMessage(content=f"show the top products by sales in region {i} for 2023"))
+        messages.append(AIMessage(content=json.dumps({
+            "action": "final_answer",
+            "final_answer": (f"<text>Top products in region {i}:\n| product | sales | orders |\n{table}</text>"
+                             f"<chart>{i:08x}-0000-4000-8000-000000000000</chart>")
+        })))
+    return messages
+
+
+def best_of(func, repeat):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run(turns_list, compressions, repeat):
+    from library.context_codec import JsonCodec, MsgpackCodec, decode_context
+
+    codecs = {"legacy json": JsonCodec()}
+    for compression in compressions:
+        try:
+            codecs[f"msgpack + {compression}"] = MsgpackCodec(compression)
+        except ImportError as e:
+            print(f"skipping {compression}: {e}")
+
+    print(f"\n{'turns':>6}  {'codec':18}{'bytes':>10}{'encode':>12}{'decode':>12}")
+    for turns in turns_list:
+        messages = build_context(turns)
+        for label, codec in codecs.items():
+            payload = codec.encode(messages)
+            assert [(type(m), m.content) for m in decode_context(payload)] == [(type(m), m.content) for m in messages]
+            encode = best_of(lambda: codec.encode(messages), repeat)
+            decode = best_of(lambda: decode_context(payload), repeat)
+            print(f"{turns:6}  {label:18}{len(payload):10}{encode * 1e6:10.1f}us{decode * 1e6:10.1f}us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--compression", nargs="+", default=["none", "zstd", "lz4"])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    with tempfile.TemporaryDirectory() as workdir:
+        # modules read ./config/config.json at import
+        os.makedirs(os.path.join(workdir, "config"))
+        with open(os.path.join(workdir, "config", "config.json"), "w") as f:
+            json.dump({"logging": {"level": "WARNING"}}, f)
+        os.chdir(workdir)
+        run(args.turns, args.compression, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Compares the old sync SQLAlchemy + asyncio.to_thread data access with the
+async session layer, using SQLite (pysqlite / aiosqlite) as a MySQL stand-in.
+
+    python benchmarks/bench_db_access.py --sessions 2000 --requests 5000 --concurrency 200
+
+SQLite has no network round trip, so absolute numbers are lower than MySQL.
+The interesting columns are the loop lag (how late a 1 ms timer fires while
+the queries run) and the peak thread count. aiosqlite runs every connection on
+its own thread, so it only bounds threads by the pool size, aiomysql uses none.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def seed(sync_engine, sessions):
+    from library.models import Base, ChatThread, Dataset
+    from library.db_connect import Session
+
+    Base.metadata.create_all(sync_engine)
+    with Session() as session:
+        for i in range(sessions):
+            dataset = Dataset(name=f"data {i}", created_by=f"s{i}",
+                              dataset_metadata={"ddls": {"sales": "CREATE TABLE sales(a INT)"},
+                                                "tabel_mapping": {"sales": f"sales_{i}"}})
+            session.add(dataset)
+            session.flush()
+            session.add(ChatThread(session_uuid=f"s{i}", title=f"s{i}",
+                                   dataset_id=dataset.dataset_id if i % 2 else None))
+        session.commit()
+
+
+def load_metadata_sync(session_id):
+    """ The query path before the async layer, run through asyncio.to_thread """
+    from library.db_connect import session_scope
+    from library.models import Dataset, ChatThread
+
+    with session_scope() as session:
+        row = session.query(
+            ChatThread.dataset_id,
+            Dataset.dataset_metadata
+        ).outerjoin(
+            Dataset, Dataset.dataset_id == ChatThread.dataset_id
+        ).filter(
+            ChatThread.session_uuid == session_id,
+            ChatThread.is_active == True
+        ).first()
+    return row
+
+
+async def measure_lag(stop: asyncio.Event, lags: list, threads: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - start - 0.001)
+        threads.append(threading.active_count())
+
+
+async def run_load(call, sessions, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, lags, threads = [], [], []
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            await call(f"s{i % sessions}")
+            latencies.append(time.perf_counter() - start)
+
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_lag(stop, lags, threads))
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(requests)])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await lag_task
+
+    latencies.sort()
+    return {
+        "rps": requests / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000,
+        "loop_lag_p95_ms": sorted(lags)[int(len(lags) * 0.95)] * 1000 if lags else 0.0,
+        "loop_lag_mean_ms": statistics.fmean(lags) * 1000 if lags else 0.0,
+        "peak_threads": max(threads, default=threading.active_count()),
+    }
+
+
+async def run(sessions, requests, concurrency):
+    import sqlalchemy
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from library import db_connect
+    from library.metadata_cache import _load_session_metadata
+
+    sync_engine = sqlalchemy.create_engine("sqlite:///bench_db.sqlite", pool_size=20, max_overflow=20)
+    async_engine = create_async_engine("sqlite+aiosqlite:///bench_db.sqlite", pool_size=20, max_overflow=20)
+    db_connect.Session.configure(bind=sync_engine)
+    db_connect.AsyncSession.configure(bind=async_engine)
+    seed(sync_engine, sessions)
+
+    async def _sync_call(session_id):
+        return await asyncio.to_thread(load_metadata_sync, session_id)
+
+    results = {}
+    for label, call in (("sync + to_thread", _sync_call), ("async session", _load_session_metadata)):
+        await run_load(call, sessions, min(requests, 200), concurrency)  # warm up pools
+        results[label] = await run_load(call, sessions, requests, concurrency)
+    await async_engine.dispose()
+
+    columns = ["rps", "p50_ms", "p95_ms", "loop_lag_mean_ms", "loop_lag_p95_ms", "peak_threads"]
+    print(f"\n{requests} metadata lookups, concurrency {concurrency}")
+    print(f"{'':20}" + "".join(f"{column:>18}" for column in columns))
+    for label, values in results.items():
+        print(f"{label:20}" + "".join(f"{values[column]:18.2f}" for column in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    with tempfile.TemporaryDirectory() as workdir:
+        # modules read ./config/config.json at import, db_connect and cache_connect need (unused) creds
+        os.makedirs(os.path.join(workdir, "config"))
+        with open(os.path.join(workdir, "config", "config.json"), "w") as f:
+            json.dump({"mysql_local": {"userName": "bench", "password": "bench", "host": "localhost",
+                                       "port": 3306, "schema": "bench"},
+                       "redis": {}, "logging": {"level": "WARNING"}}, f)
+        os.chdir(workdir)
+        asyncio.run(run(args.sessions, args.requests, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Micro benchmarks of the per turn parsing / response hot paths:
+extract_json_from_string, the streamed ReAct parser, resolve_tags,
+create_response, remove_imports, replace_table_names and
+generate_highchart_config (incl. 100k row results).
+
+    python benchmarks/bench_hot_paths.py                       # run and print
+    python benchmarks/bench_hot_paths.py --save baseline.json  # store numbers
+    python benchmarks/bench_hot_paths.py --compare benchmarks/baselines/hot_paths.json
+    python benchmarks/bench_hot_paths.py -k resolve_tags       # only matching cases
+
+Timings are the best of --repeat runs (per call), comparisons are only
+meaningful against a baseline recorded on the same machine.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def llm_outputs():
+    """ ReAct responses of increasing size, plus the shapes models get wrong """
+    action = {
+        "thought": "The user asked for sales by region, I should use the nlp_to_chart tool.",
+        "action": "nlp_to_chart",
+        "action_input": {"question": "show total sales by region for 2023", "chart_type": "column"}
+    }
+    table = "\n".join(f"| product_{i} | {i * 113.5:.2f} | {i * 7} |" for i in range(400))
+    final_large = {
+        "thought": "I have all the data, answering with a table and two charts.",
+        "action": "final_answer",
+        "final_answer": (f"<text>Here is the breakdown by product:\n| product | sales | orders |\n{table}</text>"
+                         "<chart>0b5c4a46-4d0e-4d4f-9a57-38c39a8ef0a1</chart>"
+                         "<chart>d6f1a6c1-27f5-4c0b-8d3f-1e5f8f8b5c2e</chart>")
+    }
+    return {
+        "small final answer": json.dumps({"thought": "simple", "action": "final_answer",
+                                          "final_answer": "<text>2 + 2 = 4</text>"}),
+        "action with prose": "Sure! Here is my next step:\n```json\n" + json.dumps(action, indent=2) + "\n```\nLet me know.",
+        "large final answer (20kB)": json.dumps(final_large),
+        "python dict (literal_eval)": str(action),
+        "trailing comma (invalid)": json.dumps(action)[:-1] + ",}",
+    }
+
+
+def tagged_answers():
+    charts = "".join(f"<chart>{i:08x}-0000-4000-8000-000000000000</chart>" for i in range(50))
+    return {
+        "plain text": "The dataset has 12 columns and 50,000 rows, the sales column is the only currency.",
+        "text + sql + chart": ("<text>Sales by region are shown below, the query used was:</text>"
+                               "<sql>SELECT region, SUM(sales) FROM sales GROUP BY region</sql>"
+                               "<chart>0b5c4a46-4d0e-4d4f-9a57-38c39a8ef0a1</chart>"),
+        "chart nested in text": ("<text>North leads the regions <chart>0b5c4a46-4d0e-4d4f-9a57-38c39a8ef0a1</chart>"
+                                 " followed by South.</text><text>Anything else?</text>"),
+        "50 charts, 20kB text": "<text>" + "Revenue grew steadily across all regions. " * 500 + "</text>" + charts,
+    }
+
+
+def generated_code():
+    imports = "\n".join(["import pandas as pd", "import numpy as np", "from faker import Faker",
+                         "import random", "from datetime import datetime, timedelta"])
+    body = "\n".join(f"    df['col_{i}'] = np.random.rand(n) * {i}  # import-free line" for i in range(200))
+    return imports + "\nfake = Faker()\n\ndef build(n=1000):\n    df = pd.DataFrame()\n" + body + "\n    return df\ndf = build()\n"
+
+
+SQL = {
+    "group by": "SELECT region, SUM(sales_amount) AS total_sales FROM sales GROUP BY region ORDER BY total_sales DESC",
+    "cte + join + subquery": """
+        WITH monthly AS (
+            SELECT strftime('%Y-%m', o.order_date) AS month, c.segment, SUM(o.amount) AS revenue
+            FROM orders o JOIN customers c ON c.customer_id = o.customer_id
+            WHERE o.status IN ('paid', 'shipped') GROUP BY month, c.segment
+        )
+        SELECT m.month, m.segment, m.revenue,
+               m.revenue * 1.0 / (SELECT SUM(revenue) FROM monthly m2 WHERE m2.month = m.month) AS share
+        FROM monthly m LEFT JOIN targets t ON t.segment = m.segment AND t.month = m.month
+        ORDER BY m.month, share DESC
+    """,
+}
+TABLE_MAPPING = {name: f"{name}_3f2a9c1e_5b7d_4e8f_9a0b_1c2d3e4f5a6b"
+                 for name in ("sales", "orders", "customers", "targets")}
+
+
+def result_columns(rows):
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(7)
+    return {
+        "order_date": (pd.Timestamp("2020-01-01") + pd.to_timedelta(np.arange(rows), unit="min")).to_numpy(),
+        "product": rng.choice([f"product_{i}" for i in range(200)], rows).astype(object),
+        "region": rng.choice(["North", "South", "East", "West"], rows).astype(object),
+        "sales": rng.gamma(2.0, 150.0, rows),
+        "orders": rng.integers(1, 50, rows),
+    }
+
+
+def build_cases():
+    """ name -> zero argument callable """
+    from langchain_core.messages import AIMessage
+    from library.utils import extract_json_from_string, resolve_tags, remove_imports
+    from library.react_parser import ReActStreamParser
+    from library.resolve_sql import replace_table_names
+    from library.tools import generate_highchart_config
+    from services.chat import create_response
+
+    cases = {}
+    for label, output in llm_outputs().items():
+        def _extract(output=output):
+            try:
+                extract_json_from_string(output)
+            except Exception:
+                pass
+        cases[f"extract_json_from_string[{label}]"] = _extract
+
+        # ~4 chars per streamed token
+        chunks = [output[i:i + 4] for i in range(0, len(output), 4)]
+
+        def _stream(chunks=chunks):
+            parser = ReActStreamParser()
+            for chunk in chunks:
+                if parser.feed(chunk):
+                    break
+            parser.result()
+        cases[f"ReActStreamParser[{label}]"] = _stream
+
+    for label, answer in tagged_answers().items():
+        cases[f"resolve_tags[{label}]"] = lambda answer=answer: resolve_tags(answer)
+        message = AIMessage(content=json.dumps({"thought": "t", "action": "final_answer", "final_answer": answer}))
+        extra_context = {f"{i:08x}-0000-4000-8000-000000000000": {"chart": {}} for i in range(50)}
+        cases[f"create_response[{label}]"] = lambda message=message: create_response(message, extra_context)
+
+    code = generated_code()
+    cases["remove_imports[200 line script]"] = lambda: remove_imports(code)
+
+    for label, sql in SQL.items():
+        cases[f"replace_table_names[{label}]"] = lambda sql=sql: replace_table_names(sql, TABLE_MAPPING)
+
+    loop = asyncio.new_event_loop()
+    for rows in (1_000, 100_000):
+        data = result_columns(rows)
+        charts = {
+            "line": {"x": "order_date", "y": "sales", "chart_type": "line"},
+            "column": {"x": "product", "y": ["sales", "orders"], "chart_type": "column"},
+            "series_by": {"x": "product", "y": "sales", "chart_type": "column", "series_by": "region"},
+        }
+        for label, args in charts.items():
+            _args = {"ref_key": data, "chart_title": "bench", **args}
+            cases[f"generate_highchart_config[{label}, {rows} rows]"] = (
+                lambda _args=_args: loop.run_until_complete(generate_highchart_config.ainvoke(dict(_args)))
+            )
+    return cases
+
+
+def run(pattern, repeat):
+    results = {}
+    for name, func in build_cases().items():
+        if pattern and pattern not in name:
+            continue
+        timer = timeit.Timer(func)
+        number, _ = timer.autorange()
+        results[name] = min(timer.repeat(repeat=repeat, number=number)) / number
+    return results
+
+
+def print_results(results, baseline=None):
+    header = f"{'case':64}{'per call':>14}{'calls/s':>12}"
+    print("\n" + header + (f"{'baseline':>14}{'change':>10}" if baseline else ""))
+    for name, seconds in results.items():
+        line = f"{name[:64]:64}{format_time(seconds):>14}{1 / seconds:12.0f}"
+        if baseline and name in baseline:
+            line += f"{format_time(baseline[name]):>14}{(seconds / baseline[name] - 1):+10.0%}"
+        print(line)
+
+
+def format_time(seconds):
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f} us"
+    return f"{seconds * 1e3:.2f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", dest="pattern", help="only run cases containing this text")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save", help="write the results (seconds per call) to this json file")
+    parser.add_argument("--compare", help="baseline json file written by --save")
+    args = parser.parse_args()
+
+    _save = os.path.abspath(args.save) if args.save else None
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+    sys.path.insert(0, ROOT)
+    with tempfile.TemporaryDirectory() as workdir:
+        # modules read ./config/config.json at import, the db / redis clients are never used here
+        os.makedirs(os.path.join(workdir, "config"))
+        with open(os.path.join(workdir, "config", "config.json"), "w") as f:
+            json.dump({"mysql_local": {"userName": "bench", "password": "bench", "host": "localhost",
+                                       "port": 3306, "schema": "bench"},
+                       "redis": {}, "groq-api-key": "offline", "model": "bench", "model_2": "bench",
+                       "logging": {"level": "WARNING"}, "tracing": {"enabled": False}}, f)
+        os.chdir(workdir)
+        results = run(args.pattern, args.repeat)
+
+    print_results(results, baseline)
+    if _save:
+        import platform
+        with open(_save, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(),
+                       "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Compares the sqlite and duckdb query engines on typical GROUP BY queries.
+
+    python benchmarks/bench_query_engines.py --rows 500000 --repeat 5
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUERIES = {
+    "sum by region": "SELECT region, SUM(sales_amount) AS total_sales FROM sales GROUP BY region",
+    "avg by product, region": ("SELECT product, region, AVG(sales_amount) AS avg_sale, COUNT(*) AS orders "
+                               "FROM sales GROUP BY product, region ORDER BY avg_sale DESC"),
+    "monthly revenue": ("SELECT strftime('%Y-%m', order_date) AS month, SUM(sales_amount * quantity) AS revenue "
+                        "FROM sales GROUP BY month ORDER BY month"),
+    "top 10 customers": ("SELECT customer_id, SUM(sales_amount) AS spend FROM sales "
+                         "WHERE quantity > 2 GROUP BY customer_id ORDER BY spend DESC LIMIT 10"),
+}
+
+
+def make_sales(rows, seed=7):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "order_id": np.arange(rows),
+        "customer_id": rng.integers(0, rows // 20 + 1, rows),
+        "region": rng.choice(["North", "South", "East", "West", "Central"], rows),
+        "product": rng.choice([f"product_{i}" for i in range(50)], rows),
+        "quantity": rng.integers(1, 10, rows),
+        "sales_amount": rng.gamma(2.0, 150.0, rows).round(2),
+        "order_date": pd.to_datetime("2020-01-01") + pd.to_timedelta(rng.integers(0, 1460, rows), unit="D"),
+    })
+
+
+def run(rows, repeat):
+    from library.query_engine import SQLiteEngine, DuckDBEngine
+    from library.resolve_sql import replace_table_names
+
+    df = make_sales(rows)
+    engines = [SQLiteEngine("bench.sqlite")]
+    try:
+        engines.append(DuckDBEngine("bench_parquet"))
+    except ImportError:
+        print("duckdb is not installed, benchmarking sqlite only")
+
+    results = {}
+    for engine in engines:
+        table = f"sales_{engine.name}"
+        start = time.perf_counter()
+        engine.load_table(table, df)
+        results[(engine.name, "load")] = time.perf_counter() - start
+
+        for label, sql in QUERIES.items():
+            _sql = replace_table_names(sql, {"sales": table})
+            engine.run_query(_sql)
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                engine.run_query(_sql)
+                timings.append(time.perf_counter() - start)
+            results[(engine.name, label)] = min(timings)
+
+    names = [engine.name for engine in engines]
+    print(f"\n{rows} rows, best of {repeat} (ms)")
+    print(f"{'':28}" + "".join(f"{name:>12}" for name in names))
+    for label in ["load"] + list(QUERIES):
+        print(f"{label:28}" + "".join(f"{results[(name, label)] * 1000:12.1f}" for name in names))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    with tempfile.TemporaryDirectory() as workdir:
+        # modules read ./config/config.json at import, run against an empty config
+        os.makedirs(os.path.join(workdir, "config"))
+        with open(os.path.join(workdir, "config", "config.json"), "w") as f:
+            json.dump({}, f)
+        os.chdir(workdir)
+        run(args.rows, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""
+Offline load test of the FastAPI app, run in process without network access:
+Groq is replaced by a scripted ReAct model with configurable latency, redis by
+fakeredis and mysql by SQLite (aiosqlite).
+
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/load_test.py --users 50 --turns 4 --llm-latency-ms 150
+
+Every user creates a chat, gets a dataset loaded and asks --turns questions.
+Scenarios (--scenario):
+    data  -> answer_data_question then a final answer (2 llm calls + 1 sql llm call)
+    chart -> nlp_to_chart then a final answer (2 llm calls + 2 llm_complex calls)
+    mixed -> alternates data and chart questions
+Reports p50/p95/p99 latency per endpoint, RPS and a per stage breakdown
+built from the request traces.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+REGIONS = ["North", "South", "East", "West", "Central"]
+QUESTIONS = {
+    "data": ["what is the total sales in {region}", "how many orders came from {region}",
+             "which product sold the most in {region}"],
+    "chart": ["show sales by product for {region}", "plot monthly revenue in {region}",
+              "chart order count by product in {region}"],
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+
+def make_fake_llm(latency_s, jitter_s, seed):
+    """ Builds the scripted chat model, imports langchain only after the config is in place """
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+    from langchain_core.outputs import ChatGeneration, ChatResult
+
+    rng = random.Random(seed)
+
+    def _react_reply(messages):
+        last = messages[-1]
+        if isinstance(last, ToolMessage):
+            return {"thought": "I have the observation, answering.", "action": "final_answer",
+                    "final_answer": "<text>Here is what I found.</text>"}
+        question = last.content if isinstance(last, HumanMessage) else ""
+        if question.startswith(("show", "plot", "chart")):
+            return {"thought": "chart question", "action": "nlp_to_chart",
+                    "action_input": {"question": question, "chart_type": None}}
+        return {"thought": "data question", "action": "answer_data_question",
+                "action_input": {"question": question}}
+
+    def _reply(messages):
+        system = next((m.content for m in messages if isinstance(m, SystemMessage)), "")
+        if "natural language to SQL assistant" in system:
+            region = next((r for r in REGIONS if r in messages[-1].content), REGIONS[0])
+            return ("<sql>SELECT product, SUM(sales_amount) AS total_sales, COUNT(*) AS orders FROM sales "
+                    f"WHERE region = '{region}' GROUP BY product ORDER BY total_sales DESC</sql>")
+        if "data visualization" in system:
+            return json.dumps({"x": "product", "y": "total_sales", "chart_type": "column",
+                               "series_by": None, "separate_axes": False, "chart_title": "Sales by product"})
+        if "running summary" in system:
+            return "- the user asked questions about sales by region"
+        return json.dumps(_react_reply(messages))
+
+    class ScriptedReActModel(BaseChatModel):
+        """ Deterministic stand-in for ChatGroq """
+
+        @property
+        def _llm_type(self) -> str:
+            return "scripted-react"
+
+        def bind_tools(self, tools, **kwargs):
+            return self
+
+        def _result(self, messages):
+            content = _reply(messages)
+            message = AIMessage(content=content, usage_metadata={
+                "input_tokens": sum(len(str(m.content)) // 4 for m in messages),
+                "output_tokens": len(content) // 4,
+                "total_tokens": 0
+            })
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            time.sleep(latency_s + rng.uniform(0, jitter_s))
+            return self._result(messages)
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+            await asyncio.sleep(latency_s + rng.uniform(0, jitter_s))
+            return self._result(messages)
+
+    return ScriptedReActModel()
+
+
+def install_stubs(workdir, llm_latency_s, llm_jitter_s, seed):
+    """ Points every module level client at the offline stand-ins, returns the app """
+    import fakeredis
+    import sqlalchemy
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    from library import cache_connect, db_connect
+    from library.models import Base
+
+    # both clients see one server, like the decoded / binary clients of one redis
+    _redis_server = fakeredis.FakeServer()
+    cache_connect.redis_client = fakeredis.FakeAsyncRedis(server=_redis_server, decode_responses=True)
+    cache_connect.binary_redis_client = fakeredis.FakeAsyncRedis(server=_redis_server)
+    cache_connect.blocking_redis_client = fakeredis.FakeAsyncRedis(server=_redis_server, decode_responses=True)
+    cache_connect.pubsub_redis_client = fakeredis.FakeAsyncRedis(server=_redis_server, decode_responses=True)
+
+    _db_path = os.path.join(workdir, "app_db.sqlite")
+    sync_engine = sqlalchemy.create_engine(f"sqlite:///{_db_path}")
+    Base.metadata.create_all(sync_engine)
+    db_connect.Session.configure(bind=sync_engine)
+    db_connect.AsyncSession.configure(bind=create_async_engine(f"sqlite+aiosqlite:///{_db_path}"))
+
+    fake_llm = make_fake_llm(llm_latency_s, llm_jitter_s, seed)
+    from library import tools, graph, context_memory
+    tools.llm = tools.llm_complex = fake_llm
+    graph.llm_plain = fake_llm
+    context_memory.llm = fake_llm
+
+    from app import app
+    return app
+
+
+def make_sales(rows, seed):
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "order_id": np.arange(rows),
+        "region": rng.choice(REGIONS, rows),
+        "product": rng.choice([f"product_{i}" for i in range(30)], rows),
+        "quantity": rng.integers(1, 10, rows),
+        "sales_amount": rng.gamma(2.0, 150.0, rows).round(2),
+        "order_date": pd.to_datetime("2022-01-01") + pd.to_timedelta(rng.integers(0, 730, rows), unit="D"),
+    })
+
+
+async def run(args, workdir):
+    import httpx
+    from library.tracing import get_trace
+    from library.utils import load_data_to_db
+
+    app = install_stubs(workdir, args.llm_latency_ms / 1000, args.llm_jitter_ms / 1000, args.seed)
+    sales = make_sales(args.rows, args.seed)
+    rng = random.Random(args.seed)
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    request_ids = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def call(client, method, path, session_id, **kwargs):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.request(method, path, headers={"session_id": session_id}, **kwargs)
+            latencies[path].append(time.perf_counter() - start)
+        if response.status_code != 200 or (path == "/get-ai-resp" and "encountering an issue" in response.text):
+            errors[path] += 1
+        request_ids.append(response.headers.get("x-request-id"))
+        return response
+
+    async def user(client, index):
+        session_id = f"load-test-{index}"
+        await call(client, "GET", "/create-chat", session_id)
+        # the dataset comes from generate_dataset in production, loaded directly here
+        await load_data_to_db({"sales": sales}, {"dataset_name": "sales"}, session_id)
+        for turn in range(args.turns):
+            kind = args.scenario if args.scenario != "mixed" else ("data", "chart")[(index + turn) % 2]
+            question = rng.choice(QUESTIONS[kind]).format(region=rng.choice(REGIONS))
+            await call(client, "POST", "/get-ai-resp", session_id, json={"user_query": question})
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=None) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[user(client, i) for i in range(args.users)])
+        elapsed = time.perf_counter() - start
+
+    stages = defaultdict(list)
+    for request_id in request_ids:
+        for span in get_trace(request_id) or []:
+            stages[span["name"]].append(span["duration_ms"])
+
+    total_requests = sum(len(values) for values in latencies.values())
+    report = {
+        "users": args.users, "turns": args.turns, "scenario": args.scenario,
+        "llm_latency_ms": args.llm_latency_ms, "elapsed_s": elapsed, "rps": total_requests / elapsed,
+        "endpoints": {
+            path: {"count": len(values), "errors": errors[path],
+                   **{f"p{pct}_ms": percentile(values, pct) * 1000 for pct in (50, 95, 99)}}
+            for path, values in latencies.items()
+        },
+        "stages": {
+            name: {"count": len(values), "total_ms": sum(values),
+                   **{f"p{pct}_ms": percentile(values, pct) for pct in (50, 95, 99)}}
+            for name, values in sorted(stages.items(), key=lambda item: -sum(item[1]))
+        }
+    }
+    return report
+
+
+def print_report(report):
+    print(f"\n{report['users']} users x {report['turns']} turns, scenario {report['scenario']}, "
+          f"llm latency {report['llm_latency_ms']} ms")
+    print(f"elapsed {report['elapsed_s']:.2f}s  throughput {report['rps']:.1f} req/s\n")
+
+    print(f"{'endpoint':24}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for path, values in report["endpoints"].items():
+        print(f"{path:24}{values['count']:8}{values['errors']:8}"
+              f"{values['p50_ms']:10.1f}{values['p95_ms']:10.1f}{values['p99_ms']:10.1f}")
+
+    # stages are nested (run_tools contains the tool spans), share is the time in a stage over all request time
+    _total = sum(values["total_ms"] for name, values in report["stages"].items() if " /" in name) or 1
+    print(f"\n{'stage':36}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'% of req':>10}")
+    for name, values in report["stages"].items():
+        _share = "" if " /" in name else f"{values['total_ms'] / _total:10.1%}"
+        print(f"{name[:36]:36}{values['count']:8}{values['p50_ms']:10.2f}"
+              f"{values['p95_ms']:10.2f}{values['p99_ms']:10.2f}{_share:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=50, help="max requests in flight")
+    parser.add_argument("--scenario", choices=["data", "chart", "mixed"], default="mixed")
+    parser.add_argument("--llm-latency-ms", type=float, default=150)
+    parser.add_argument("--llm-jitter-ms", type=float, default=50)
+    parser.add_argument("--rows", type=int, default=20_000, help="rows of the sales dataset per user")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    _json_path = os.path.abspath(args.json) if args.json else None
+    with tempfile.TemporaryDirectory() as workdir:
+        # modules read ./config/config.json at import, clients built there are replaced by install_stubs
+        os.makedirs(os.path.join(workdir, "config"))
+        with open(os.path.join(workdir, "config", "config.json"), "w") as f:
+            json.dump({
+                "mysql_local": {"userName": "bench", "password": "bench", "host": "localhost",
+                                "port": 3306, "schema": "bench"},
+                "redis": {}, "groq-api-key": "offline", "model": "scripted", "model_2": "scripted",
+                "logging": {"level": "WARNING"},
+                "tracing": {"max_traces": 100_000}
+            }, f)
+        os.chdir(workdir)
+        report = asyncio.run(run(args, workdir))
+
+    print_report(report)
+    if _json_path:
+        with open(_json_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import time
+from src.common import get_config
+
+_budget_config = get_config("graph_budget") or {}
+
+MAX_TOOL_ITERATIONS = _budget_config.get("max_tool_iterations", 6)
+DEADLINE_SECONDS = _budget_config.get("deadline_seconds", 120)
+NODE_TIMEOUTS = {
+    "chatbot": 45,
+    "tools": 100,
+    "partial_answer": 15,
+    **_budget_config.get("node_timeouts", {})
+}
+# the partial answer llm call is skipped below its typical latency and ends SAFETY_MARGIN before the deadline
+PARTIAL_ANSWER_MIN_SECONDS = _budget_config.get("partial_answer_min_seconds", 3)
+SAFETY_MARGIN = _budget_config.get("safety_margin_seconds", 0.5)
+# every tool iteration is a chatbot + tools step, plus the last chatbot and partial_answer steps
+RECURSION_LIMIT = _budget_config.get("recursion_limit", 2 * MAX_TOOL_ITERATIONS + 4)
+
+
+class Budget:
+    """
+    Per request budget of a graph run: tool iterations and a wall clock deadline.
+    Every llm and tool call is bounded by the node timeout and the time left.
+    """
+
+    def __init__(self, max_iterations=MAX_TOOL_ITERATIONS, deadline_seconds=DEADLINE_SECONDS):
+        self.max_iterations = max_iterations
+        self.iterations = 0
+        self.deadline = time.monotonic() + deadline_seconds
+
+    def remaining(self) -> float:
+        """ Seconds left before the deadline """
+        return max(self.deadline - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def exhausted(self) -> bool:
+        """ No time or tool iterations left """
+        return self.expired() or self.iterations >= self.max_iterations
+
+    def timeout(self, node: str, limit: float | None = None) -> float:
+        """ Timeout for a call in a node: node timeout, optional call limit and the time left """
+        return min(NODE_TIMEOUTS.get(node, DEADLINE_SECONDS), limit or DEADLINE_SECONDS, self.remaining())
@@ -1,20 +1,173 @@
+import time
 import redis.asyncio as redis
+from redis.asyncio.retry import Retry
+from redis.backoff import EqualJitterBackoff
+from redis import exceptions
 from src.common import get_config
 from src.main_logger import logger
+from library.metrics import REDIS_DURATION
+from library.tracing import span
 
 redis_creds = get_config("redis")
-redis_client = redis.Redis(**redis_creds, decode_responses=True)
-logger.info("connected to redis sucessfully")
+_pool_config = get_config("redis_pool") or {}
+
+# per client, a command waits up to POOL_TIMEOUT for a free connection when all are in use
+MAX_CONNECTIONS = _pool_config.get("max_connections", 200)
+POOL_TIMEOUT = _pool_config.get("pool_timeout", 5)
+# websocket pubsub subscriptions hold a connection each, they get their own pool
+PUBSUB_MAX_CONNECTIONS = _pool_config.get("pubsub_max_connections", 1000)
+SOCKET_TIMEOUT = _pool_config.get("socket_timeout", 5)
+SOCKET_CONNECT_TIMEOUT = _pool_config.get("socket_connect_timeout", 2)
+HEALTH_CHECK_INTERVAL = _pool_config.get("health_check_interval", 30)
+RETRIES = _pool_config.get("retries", 3)
+BACKOFF_BASE = _pool_config.get("backoff_base", 0.05)
+BACKOFF_CAP = _pool_config.get("backoff_cap", 1.0)
+
+# marks a read the caller did not batch, unlike None (batched, key missing)
+NOT_FETCHED = object()
+
+
+class InstrumentedRedis(redis.Redis):
+    """ Redis client recording command durations and trace spans """
+
+    async def execute_command(self, *args, **options):
+        command = str(args[0]).upper()
+        start = time.perf_counter()
+        try:
+            with span(f"redis {command}"):
+                return await super().execute_command(*args, **options)
+        finally:
+            REDIS_DURATION.labels(command).observe(time.perf_counter() - start)
+
+
+def _build_client(decode_responses: bool, socket_timeout=SOCKET_TIMEOUT,
+                  max_connections=MAX_CONNECTIONS) -> InstrumentedRedis:
+    """
+    Client over its own blocking connection pool: past max_connections a command
+    waits up to POOL_TIMEOUT for a free connection instead of failing.
+    Commands time out after socket_timeout, idle connections are pinged before reuse.
+    Only connection errors are retried (jittered exponential backoff), a timed out
+    command may already have run on the server and is not sent again
+    """
+    _creds = dict(redis_creds)
+    _connection_class = redis.SSLConnection if _creds.pop("ssl", False) else redis.Connection
+    pool = redis.BlockingConnectionPool(
+        **_creds,
+        connection_class=_connection_class,
+        max_connections=max_connections,
+        timeout=POOL_TIMEOUT,
+        decode_responses=decode_responses,
+        socket_timeout=socket_timeout,
+        socket_connect_timeout=SOCKET_CONNECT_TIMEOUT,
+        socket_keepalive=True,
+        health_check_interval=HEALTH_CHECK_INTERVAL,
+        retry=Retry(EqualJitterBackoff(cap=BACKOFF_CAP, base=BACKOFF_BASE), RETRIES,
+                    supported_errors=(exceptions.ConnectionError,)),
+        retry_on_error=[exceptions.ConnectionError]
+    )
+    client = InstrumentedRedis(connection_pool=pool)
+    # the client closes the pool it was given on aclose
+    client.auto_close_connection_pool = True
+    return client
+
+
+redis_client = None
+binary_redis_client = None
+blocking_redis_client = None
+pubsub_redis_client = None
+
 
 def get_redis():
-    """ Returns a Redis Client """
+    """ Returns the shared Redis Client (decoded responses) """
     try:
         global redis_client
-        if redis_client:
-            logger.info("returning global redis")
-            return redis_client
-        client = redis.Redis(**redis_creds, decode_responses=True)
-        return client
+        if redis_client is None:
+            redis_client = _build_client(decode_responses=True)
+        return redis_client
     except Exception as e:
         logger.exception(f"error in getting redis connection {e}")
-        return None
\ No newline at end of file
+        return None
+
+
+def get_binary_redis():
+    """ Returns the shared Redis Client without response decoding (for binary payloads) """
+    try:
+        global binary_redis_client
+        if binary_redis_client is None:
+            binary_redis_client = _build_client(decode_responses=False)
+        return binary_redis_client
+    except Exception as e:
+        logger.exception(f"error in getting binary redis connection {e}")
+        return None
+
+
+def get_blocking_redis():
+    """
+    Returns the Redis Client for blocking reads (BLMOVE/BLPOP).
+    It has no socket timeout, the server side timeout of the command ends the wait
+    """
+    try:
+        global blocking_redis_client
+        if blocking_redis_client is None:
+            blocking_redis_client = _build_client(decode_responses=True, socket_timeout=None)
+        return blocking_redis_client
+    except Exception as e:
+        logger.exception(f"error in getting blocking redis connection {e}")
+        return None
+
+
+def get_pubsub_redis():
+    """
+    Returns the Redis Client for pub/sub subscriptions, no socket timeout.
+    Every subscription holds a connection, its own pool keeps them from starving other clients
+    """
+    try:
+        global pubsub_redis_client
+        if pubsub_redis_client is None:
+            pubsub_redis_client = _build_client(decode_responses=True, socket_timeout=None,
+                                                max_connections=PUBSUB_MAX_CONNECTIONS)
+        return pubsub_redis_client
+    except Exception as e:
+        logger.exception(f"error in getting pubsub redis connection {e}")
+        return None
+
+
+async def init_redis():
+    """ Builds both clients and checks the server at startup, a failed ping is only logged """
+    for client in (get_redis(), get_binary_redis()):
+        try:
+            await client.ping()
+        except Exception as e:
+            logger.exception(f"redis health check failed {e}")
+            return
+    logger.info(f"connected to redis sucessfully (pool size {MAX_CONNECTIONS})")
+
+
+async def close_redis():
+    """ Closes the clients and their connection pools at shutdown """
+    global redis_client, binary_redis_client, blocking_redis_client, pubsub_redis_client
+    for client in (redis_client, binary_redis_client, blocking_redis_client, pubsub_redis_client):
+        if client is not None:
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.exception(f"error in closing redis client {e}")
+    redis_client, binary_redis_client, blocking_redis_client, pubsub_redis_client = None, None, None, None
+
+
+async def batch(commands, binary=False) -> list:
+    """
+    Sends commands [(name, *args), ...] in one pipelined round trip (no MULTI)
+    Returns:
+        replies in order, a failed command returns its exception
+    """
+    client = get_binary_redis() if binary else get_redis()
+    start = time.perf_counter()
+    try:
+        with span("redis PIPELINE", commands=len(commands)):
+            async with client.pipeline(transaction=False) as pipe:
+                for command in commands:
+                    pipe.execute_command(*command)
+                return await pipe.execute(raise_on_error=False)
+    finally:
+        REDIS_DURATION.labels("PIPELINE").observe(time.perf_counter() - start)
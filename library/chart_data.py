@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+from src.common import get_config
+
+_chart_config = get_config("chart_data") or {}
+
+MAX_POINTS = {
+    "line": 2000,
+    "spline": 2000,
+    "area": 2000,
+    "areaspline": 2000,
+    "scatter": 5000,
+    "column": 50,
+    "bar": 50,
+    "pie": 12,
+    "default": 1000,
+    **_chart_config.get("max_points", {})
+}
+CONTINUOUS_CHARTS = ("line", "spline", "area", "areaspline", "scatter")
+OTHER_LABEL = "Other"
+
+
+def max_points(chart_type: str) -> int:
+    """ Max points sent to the browser for a chart type """
+    return MAX_POINTS.get(chart_type, MAX_POINTS["default"])
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling
+    Returns the indices of the points to keep (always keeps first and last point)
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    # bucket i covers points [edges[i], edges[i + 1]) between first and last point
+    every = (n - 2) / (threshold - 2)
+    edges = np.minimum(np.floor(np.arange(threshold) * every).astype(np.int64) + 1, n)
+
+    selected = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # average of the next bucket, the last point for the final bucket
+        next_start, next_end = edges[bucket + 1], min(edges[bucket + 2], n) if bucket + 2 < threshold else n
+        avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+
+        bucket_x, bucket_y = x[start:end], y[start:end]
+        areas = np.abs(
+            (x[selected] - avg_x) * (bucket_y - y[selected])
+            - (x[selected] - bucket_x) * (avg_y - y[selected])
+        )
+        selected = start + int(np.argmax(areas))
+        indices[bucket + 1] = selected
+    return indices
+
+
+def top_n_other(categories: np.ndarray, values: np.ndarray, n: int):
+    """
+    Keeps the n-1 largest categories (by row total) and sums the rest into "Other"
+    values: 2d array (rows x series)
+    """
+    if len(categories) <= n:
+        return categories, values
+    _grouped = pd.DataFrame(values).groupby(categories, sort=False).sum()
+    if len(_grouped) <= n:
+        return _grouped.index.to_numpy(dtype=object), _grouped.to_numpy(dtype=float)
+    _order = _grouped.sum(axis=1).sort_values(ascending=False).index
+    head, rest = _grouped.loc[_order[:n - 1]], _grouped.loc[_order[n - 1:]]
+    return (np.append(head.index.to_numpy(dtype=object), OTHER_LABEL),
+            np.vstack((head.to_numpy(dtype=float), rest.sum().to_numpy(dtype=float))))
+
+
+def _pairs(x: np.ndarray, y: np.ndarray) -> list:
+    """ Compact [x, y] series data, NaN -> null """
+    if np.isnan(y).any():
+        return [[_x, None if np.isnan(_y) else _y] for _x, _y in zip(x.tolist(), y.tolist())]
+    return np.column_stack((x, y)).tolist()
+
+
+def pivot_series(data: dict, x: str, y_columns: list, series_by: str | None = None):
+    """
+    Turns result columns into one x axis and a set of named series in one pass.
+    With series_by, every (y column, group) pair becomes a series and x values
+    keep their first appearance order.
+    Returns:
+        x values, {series name: values}, {series name: y column}
+    """
+    if not series_by:
+        return data[x], {y: data[y] for y in y_columns}, {y: y for y in y_columns}
+
+    frame = pd.DataFrame({column: data[column] for column in dict.fromkeys([x, series_by, *y_columns])})
+    wide = frame.pivot_table(index=x, columns=series_by, values=y_columns, aggfunc="sum", sort=False)
+    # keep the row order of the query (ORDER BY, month order), not the lexical order
+    wide = wide.reindex(frame[x].dropna().unique())
+    series, series_columns = {}, {}
+    for y, group in wide.columns:
+        name = str(group) if len(y_columns) == 1 else f"{y} - {group}"
+        series[name] = wide[(y, group)].to_numpy()
+        series_columns[name] = y
+    return wide.index.to_numpy(), series, series_columns
+
+
+def build_chart_data(x_values, series: dict, chart_type: str, limit: int | None = None) -> dict:
+    """
+    Builds highcharts series data in one vectorized pass
+    series: {series name: y values}
+    Returns:
+        {"series": [{"name", "data": [[x, y], ...]}], "categories": list | None,
+         "x_type": "category" | "datetime" | "linear", "total_points": n, "downsampled": bool}
+    """
+    limit = limit or max_points(chart_type)
+    names = list(series)
+    x = pd.Series(x_values)
+    values = np.column_stack([
+        pd.to_numeric(pd.Series(series[name]), errors="coerce").to_numpy(dtype=float) for name in names
+    ])
+    total_points = len(x)
+
+    if chart_type in CONTINUOUS_CHARTS:
+        if pd.api.types.is_numeric_dtype(x):
+            x_type, x_numeric = "linear", x.to_numpy(dtype=float)
+        elif pd.api.types.is_datetime64_any_dtype(x):
+            x_type, x_numeric = "datetime", (x.astype("datetime64[ms]").astype("int64")).to_numpy(dtype=float)
+        else:
+            x_type, x_numeric = "category", np.arange(len(x), dtype=float)
+
+        if x_type != "category":
+            # lttb buckets and highcharts linear / datetime axes need ascending x
+            order = np.argsort(x_numeric, kind="stable")
+            x_numeric, values = x_numeric[order], values[order]
+
+        if x_type == "category":
+            # series share the category axis, so they share the kept points
+            keep = lttb(x_numeric, np.nan_to_num(values).sum(axis=1), limit)
+            categories = x.astype(str).to_numpy()[keep].tolist()
+            _x = np.arange(len(keep), dtype=float)
+            _series = [{"name": name, "data": _pairs(_x, values[keep, i])} for i, name in enumerate(names)]
+            downsampled = len(keep) < total_points
+        else:
+            categories, _series, downsampled = None, [], False
+            for i, name in enumerate(names):
+                keep = lttb(x_numeric, np.nan_to_num(values[:, i]), limit)
+                downsampled = downsampled or len(keep) < total_points
+                _series.append({"name": name, "data": _pairs(x_numeric[keep], values[keep, i])})
+        return {"series": _series, "categories": categories, "x_type": x_type,
+                "total_points": total_points, "downsampled": downsampled}
+
+    categories, values = top_n_other(x.astype(str).to_numpy(dtype=object), values, limit)
+    if chart_type == "pie":
+        # a pie shows one series
+        _series = [{"name": names[0], "data": [[name, None if np.isnan(value) else value]
+                                               for name, value in zip(categories.tolist(), values[:, 0].tolist())]}]
+    else:
+        _x = np.arange(len(categories), dtype=float)
+        _series = [{"name": name, "data": _pairs(_x, values[:, i])} for i, name in enumerate(names)]
+    return {"series": _series, "categories": [str(c) for c in categories.tolist()], "x_type": "category",
+            "total_points": total_points, "downsampled": len(categories) < total_points}
@@ -0,0 +1,181 @@
+from abc import ABC, abstractmethod
+from json import loads, dumps
+import msgpack
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, ToolMessage
+from langchain_core.messages.utils import messages_from_dict
+from src.common import get_config
+from src.main_logger import logger
+
+_codec_config = get_config("context_codec") or {}
+
+CODEC = _codec_config.get("codec", "msgpack")
+COMPRESSION = _codec_config.get("compression", "zstd")
+COMPRESS_MIN_BYTES = _codec_config.get("compress_min_bytes", 512)
+ZSTD_LEVEL = _codec_config.get("zstd_level", 3)
+
+# 0xc1 is never used by msgpack and can not start a json document, so a
+# versioned payload is told apart from the legacy json list by its first byte.
+# header: magic, codec version, compression id
+MAGIC = 0xc1
+# compact schema: [role, content] or [role, content, tool_call_id]
+ROLES = (SystemMessage, HumanMessage, AIMessage, ToolMessage)
+_ROLE_IDS = {message_type: role for role, message_type in enumerate(ROLES)}
+
+
+def _role_id(msg) -> int:
+    """ Role of a message, subclasses (e.g. AIMessageChunk) map to their base role """
+    role = _ROLE_IDS.get(type(msg))
+    if role is None:
+        role = next((role for role, message_type in enumerate(ROLES) if isinstance(msg, message_type)), None)
+        if role is None:
+            raise TypeError(f"unsupported message type {type(msg).__name__} in chat context")
+    return role
+
+
+class Compressor:
+    """ Compression applied to encoded contexts above COMPRESS_MIN_BYTES """
+    name = ""
+    id = 0
+
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def decompress(self, data: bytes) -> bytes:
+        return data
+
+
+class ZstdCompressor(Compressor):
+    name = "zstd"
+    id = 1
+
+    def __init__(self, level=ZSTD_LEVEL):
+        import zstandard
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return self._decompressor.decompress(data)
+
+
+class LZ4Compressor(Compressor):
+    """ Faster, larger output than zstd, needs the optional lz4 package """
+    name = "lz4"
+    id = 2
+
+    def __init__(self):
+        import lz4.frame
+        self._lz4 = lz4.frame
+
+    def compress(self, data: bytes) -> bytes:
+        return self._lz4.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return self._lz4.decompress(data)
+
+
+_COMPRESSORS = {"none": Compressor, "zstd": ZstdCompressor, "lz4": LZ4Compressor}
+_compressors = {}
+
+
+def get_compressor(name_or_id) -> Compressor:
+    """ Compressor by config name or header id, instances are shared """
+    if isinstance(name_or_id, int):
+        name_or_id = next(name for name, cls in _COMPRESSORS.items() if cls.id == name_or_id)
+    if name_or_id not in _compressors:
+        _compressors[name_or_id] = _COMPRESSORS[name_or_id]()
+    return _compressors[name_or_id]
+
+
+class ContextCodec(ABC):
+    """
+    Serialization of the chat context stored on redis (context_codec.codec).
+    Every codec can read the payloads of all versions, so switching the codec
+    or upgrading the schema migrates keys on their next write.
+    """
+    name = ""
+    version = 0
+
+    @abstractmethod
+    def encode(self, messages) -> bytes:
+        """ Payload stored on redis for a list of messages """
+
+    def decode(self, payload: bytes) -> list:
+        return decode_context(payload)
+
+
+class JsonCodec(ContextCodec):
+    """ Legacy format, every langchain message field as json (version 0, no header) """
+    name = "json"
+    version = 0
+
+    def encode(self, messages) -> bytes:
+        return dumps([msg.model_dump() for msg in messages]).encode()
+
+
+class MsgpackCodec(ContextCodec):
+    """ Compact schema as msgpack, compressed above COMPRESS_MIN_BYTES (version 1) """
+    name = "msgpack"
+    version = 1
+
+    def __init__(self, compression=COMPRESSION):
+        self.compressor = get_compressor(compression)
+
+    def encode(self, messages) -> bytes:
+        _rows = []
+        for msg in messages:
+            _row = [_role_id(msg), msg.content]
+            if isinstance(msg, ToolMessage):
+                _row.append(msg.tool_call_id)
+            _rows.append(_row)
+        data = msgpack.packb(_rows)
+        compressor = self.compressor if len(data) >= COMPRESS_MIN_BYTES else get_compressor("none")
+        return bytes((MAGIC, self.version, compressor.id)) + compressor.compress(data)
+
+
+def _decode_v1(data: bytes) -> list:
+    messages = []
+    for row in msgpack.unpackb(data):
+        message_type = ROLES[row[0]]
+        if message_type is ToolMessage:
+            messages.append(ToolMessage(content=row[1], tool_call_id=row[2]))
+        else:
+            messages.append(message_type(content=row[1]))
+    return messages
+
+
+def _decode_legacy(data: bytes) -> list:
+    # stored as [msg.dict()], flat fields rather than the {"type", "data"} shape messages_from_dict expects
+    return messages_from_dict([
+        msg if "data" in msg else {"type": msg["type"], "data": msg} for msg in loads(data)
+    ])
+
+
+_DECODERS = {1: _decode_v1}
+
+
+def decode_context(payload) -> list:
+    """ Rebuilds the messages of a stored context, of any codec version """
+    if isinstance(payload, str):
+        payload = payload.encode()
+    if payload[0] != MAGIC:
+        return _decode_legacy(payload)
+    version, compression = payload[1], payload[2]
+    if version not in _DECODERS:
+        raise ValueError(f"unknown context codec version {version}")
+    return _DECODERS[version](get_compressor(compression).decompress(payload[3:]))
+
+
+_CODECS = {"json": JsonCodec, "msgpack": MsgpackCodec}
+_codec = None
+
+
+def get_context_codec() -> ContextCodec:
+    """ Returns the configured context codec (context_codec.codec, default msgpack) """
+    global _codec
+    if _codec is None:
+        _codec = _CODECS[CODEC]()
+        logger.info(f"using {_codec.name} context codec")
+    return _codec
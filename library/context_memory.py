@@ -0,0 +1,118 @@
+from json import loads, dumps
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from src.common import get_config
+from src.main_logger import logger
+from library.llm_resp import llm
+from library.prompts import CONTEXT_SUMMARY_PROMPT
+
+_memory_config = get_config("context_memory") or {}
+
+MAX_TURNS = _memory_config.get("max_turns", 6)
+TOKEN_BUDGET = _memory_config.get("token_budget", 3000)
+MAX_MESSAGE_CHARS = _memory_config.get("max_message_chars", 4000)
+MAX_SUMMARY_CHARS = _memory_config.get("max_summary_chars", 2000)
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+
+def estimate_tokens(messages) -> int:
+    """ Rough token estimate (~4 chars per token) """
+    return sum(len(str(msg.content)) for msg in messages) // 4
+
+
+def _truncate(text: str, limit: int) -> str:
+    """ Truncates text to limit chars """
+    if len(text) <= limit:
+        return text
+    return text[:limit] + " ...[truncated]"
+
+
+def _compact_answer(msg: AIMessage) -> AIMessage:
+    """ Keeps only the final answer of an AI message, drops the thought """
+    content = str(msg.content)
+    try:
+        _parsed = loads(content)
+        if isinstance(_parsed, dict) and "final_answer" in _parsed:
+            content = dumps({"action": "final_answer", "final_answer": _parsed["final_answer"]})
+    except Exception:
+        pass
+    return AIMessage(content=_truncate(content, MAX_MESSAGE_CHARS))
+
+
+def split_turns(messages):
+    """
+    Splits a message list into the rolling summary and conversation turns.
+    A turn is the user message and the last AI message replying to it,
+    intermediate tool proposals and tool observations are dropped.
+
+    Returns:
+        (summary, turns) where turns is a list of (HumanMessage, AIMessage)
+    """
+    summary = ""
+    turns = []
+    _user_msg, _ai_msg = None, None
+
+    for msg in messages:
+        if isinstance(msg, SystemMessage):
+            if str(msg.content).startswith(SUMMARY_PREFIX):
+                summary = str(msg.content)[len(SUMMARY_PREFIX):]
+        elif isinstance(msg, HumanMessage):
+            if _user_msg is not None and _ai_msg is not None:
+                turns.append((_user_msg, _ai_msg))
+            _user_msg = HumanMessage(content=_truncate(str(msg.content), MAX_MESSAGE_CHARS))
+            _ai_msg = None
+        elif isinstance(msg, AIMessage) and _user_msg is not None:
+            _ai_msg = msg
+
+    if _user_msg is not None and _ai_msg is not None:
+        turns.append((_user_msg, _ai_msg))
+
+    return summary, [(user, _compact_answer(ai)) for user, ai in turns]
+
+
+def _fallback_summary(summary: str, turns) -> str:
+    """ Extractive summary used when llm summarization fails """
+    lines = [summary] if summary else []
+    for user, ai in turns:
+        lines.append(f"- user: {_truncate(str(user.content), 200)} | assistant: {_truncate(str(ai.content), 200)}")
+    return "\n".join(lines)[-MAX_SUMMARY_CHARS:]
+
+
+async def summarize_turns(summary: str, turns) -> str:
+    """ Folds dropped turns into the rolling summary """
+    try:
+        _turns_text = "\n".join(
+            f"User: {user.content}\nAssistant: {ai.content}" for user, ai in turns
+        )
+        messages = [
+            SystemMessage(content=CONTEXT_SUMMARY_PROMPT),
+            HumanMessage(content=f"Current summary:\n{summary or '(empty)'}\n\nTurns to fold in:\n{_turns_text}")
+        ]
+        llm_resp = await llm.ainvoke(messages)
+        return _truncate(str(llm_resp.content).strip(), MAX_SUMMARY_CHARS)
+    except Exception as e:
+        logger.exception(f"error in summarizing context {e}")
+    return _fallback_summary(summary, turns)
+
+
+async def compact_context(messages):
+    """
+    Bounds the conversation memory stored on redis.
+    Keeps the last MAX_TURNS turns within TOKEN_BUDGET, older turns
+    are folded into a rolling summary stored as the first message.
+    """
+    summary, turns = split_turns(messages)
+
+    dropped = []
+    while len(turns) > MAX_TURNS:
+        dropped.append(turns.pop(0))
+    while len(turns) > 1 and estimate_tokens([msg for turn in turns for msg in turn]) > TOKEN_BUDGET:
+        dropped.append(turns.pop(0))
+
+    if dropped:
+        logger.info(f"folding {len(dropped)} turns into context summary")
+        summary = await summarize_turns(summary, dropped)
+
+    compacted = [SystemMessage(content=SUMMARY_PREFIX + summary)] if summary else []
+    for user, ai in turns:
+        compacted.extend([user, ai])
+    return compacted
@@ -1,16 +1,20 @@
+import time
 import sqlalchemy
+from sqlalchemy import event
 from sqlalchemy.orm import sessionmaker
-from typing import Generator
-from contextlib import contextmanager
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from typing import Generator, AsyncGenerator
+from contextlib import contextmanager, asynccontextmanager
 from src.common import get_config
+from library.metrics import MYSQL_DURATION
 
 
-def get_connector(schema="mysql_local"):
+def get_connector(schema="mysql_local", drivername="mysql+pymysql"):
     """ database connection creds """
 
     config = get_config(schema)
 
-    connect_url = sqlalchemy.engine.URL.create(drivername='mysql+pymysql',
+    connect_url = sqlalchemy.engine.URL.create(drivername=drivername,
                                                username=config["userName"],
                                                password=config["password"],
                                                host=config["host"],
@@ -24,6 +28,32 @@ engine = sqlalchemy.create_engine(get_connector(), pool_size=15,
                                   pool_recycle=300,
                                   pool_pre_ping=True,
                                   pool_use_lifo=True)
+
+
+# async engine for the request path, db waits do not hold a threadpool slot
+async_engine = create_async_engine(get_connector(drivername="mysql+aiomysql"), pool_size=15,
+                                   max_overflow=20,
+                                   pool_recycle=300,
+                                   pool_pre_ping=True,
+                                   pool_use_lifo=True)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _starts = conn.info.get("query_start")
+    if _starts:
+        _statement = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+        MYSQL_DURATION.labels(_statement).observe(time.perf_counter() - _starts.pop())
+
+
+for _engine in (engine, async_engine.sync_engine):
+    event.listen(_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(_engine, "after_cursor_execute", _after_cursor_execute)
+
+
 Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
@@ -39,6 +69,22 @@ def session_scope() -> Generator:
         session.close()
 
 
+AsyncSession = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=async_engine)
+
+
+@asynccontextmanager
+async def async_session_scope() -> AsyncGenerator:
+    """ Async transactional scope, the session is closed on exit """
+
+    session = None
+    try:
+        session = AsyncSession()
+        yield session
+    finally:
+        if session is not None:
+            await session.close()
+
+
 def receive_query(query):
     """ result dict formatter """
     return [row._asdict() for row in query]
\ No newline at end of file
@@ -1,23 +1,62 @@
-from json import loads, dumps, JSONDecodeError
+import asyncio
+from json import dumps
 from uuid import uuid4
 from typing import Annotated, TypedDict
 from langgraph.graph import StateGraph, END, START
-from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage, message_chunk_to_message
 from src.main_logger import logger
+from src.common import get_config
 from library.tools import (nl_sql_agent, execute_query, generate_highchart_config,
-                           generate_dataset, get_llm_with_tools, nlp_to_chart)
-from library.utils import trace_call, load_data_to_db, create_observation, get_tabel_mapping
+                           get_llm_with_tools, nlp_to_chart, answer_data_question,
+                           extract_sql_query, record_sql_outcome)
+from library.utils import trace_call, create_observation, get_tabel_mapping
+from library.jobs import enqueue_dataset_job
+from library.result_store import ResultStore
+from library.budget import Budget, RECURSION_LIMIT, PARTIAL_ANSWER_MIN_SECONDS, SAFETY_MARGIN
+from library.tracing import span
+from library.resolve_sql import canonical_sql
+from library.prompts import PARTIAL_ANSWER_PROMPT
+from library.llm_resp import llm as llm_plain
 from langgraph.graph.message import add_messages
 from library.utils import extract_json_from_string
+from library.react_parser import ReActStreamParser, parse_message, parse_json_object, REACT_CACHE_KEY
 
 class State(TypedDict):
     llm_context: Annotated[list, add_messages]
     extra_context: dict
+    result_store: ResultStore
     session_id: str
+    budget: Budget
+    # canonical generated query -> (question, nl_sql_agent response), cached once execute_query ran it
+    pending_sql: dict
 
 
 graph_builder = StateGraph(State)
 
+TOOL_TIMEOUTS = {
+    "default": 60,
+    "nlp_to_chart": 90,
+    "answer_data_question": 90,
+    **(get_config("tool_timeouts") or {})
+}
+
+
+def get_actions(message: AIMessage) -> list:
+    """
+    Returns the proposed tool calls of a ReAct response as a list of
+    {"action", "action_input"}, supports a single action or an `actions` array.
+    The parsed json is cached on the message, check_tools and run_tools share it
+    """
+    _msg_content = parse_message(message)
+    if not isinstance(_msg_content, dict):
+        return []
+    if isinstance(_msg_content.get("actions"), list):
+        return [action for action in _msg_content["actions"]
+                if isinstance(action, dict) and action.get("action") not in (None, "final_answer")]
+    if all(key in _msg_content for key in ("action", "action_input")) and _msg_content["action"] != "final_answer":
+        return [{"action": _msg_content["action"], "action_input": _msg_content["action_input"]}]
+    return []
+
 
 @trace_call
 async def check_tools(state: State):
@@ -26,15 +65,17 @@ async def check_tools(state: State):
         last_msg = state.get("llm_context")[-1]
 
         if isinstance(last_msg, AIMessage):
-            try:
-                _msg_content = extract_json_from_string(last_msg.content)
-            except (JSONDecodeError, TypeError) as e:
-                logger.info(f"Failed to parse last_msg.content as JSON: {e}")
-                return END
-
-            if all(key in _msg_content for key in ("action", "action_input")):
-                logger.info(f"Found tool call: {_msg_content}")
+            _actions = get_actions(last_msg)
+            if _actions:
+                logger.info(f"Found tool calls: {_actions}")
+                if state["budget"].exhausted():
+                    logger.info("budget exhausted, falling back to partial answer")
+                    return "partial_answer"
                 return "tools"
+        else:
+            # the llm call failed or ran out of time, no answer to return
+            logger.info("No llm response for the last step.")
+            return "partial_answer"
 
         logger.info("No tool calls found.")
     except Exception as e:
@@ -43,111 +84,221 @@ async def check_tools(state: State):
     return END
 
 
+async def call_tool(tool_name, tool_args, state: State):
+    """ Runs one tool, returns the observation for the llm """
+    match tool_name:
+        case "nl_sql_agent":
+            tool_args["session_id"] = state["session_id"]
+            _tool_args = dumps(tool_args)
+            response = await nl_sql_agent.ainvoke((_tool_args))
+            _query = extract_sql_query(response)
+            if _query:
+                state["pending_sql"][canonical_sql(_query)] = (tool_args.get("question", ""), response)
+            return response
+
+        case "execute_query":
+            _tabel_mapping = await get_tabel_mapping(state["session_id"])
+            tool_args["tabel_mapping"] = _tabel_mapping
+            _tool_args = dumps(tool_args)
+            df, metadata = await execute_query.ainvoke(_tool_args)
+            # the llm often reformats the generated sql before running it
+            _pending = state["pending_sql"].pop(canonical_sql(str(tool_args.get("query", ""))), None)
+            if _pending:
+                _question, _response = _pending
+                await record_sql_outcome(_question, state["session_id"], _response, "error_message" not in metadata)
+            if "error_message" not in metadata:
+                _, metadata = state["result_store"].put(df)
+            return metadata
+
+        case "answer_data_question":
+            _args = {
+                "question": tool_args.get("question", ""),
+                "session_id": state["session_id"]
+            }
+            df, metadata = await answer_data_question.ainvoke(dumps(_args))
+            if "error_message" not in metadata:
+                _, _stored = state["result_store"].put(df)
+                metadata = {**_stored, "sql": metadata["sql"], "preview": metadata["preview"]}
+            return metadata
+
+        case "generate_highchart_config":
+            df_key = tool_args.pop("ref_key", "")
+            data = state["result_store"].get(df_key)
+            if data is None:
+                return "Unable to generate chart at the moment"
+            tool_args["ref_key"] = data
+            chart_type = tool_args.get("chart_type","column")
+            ref_key, chart_config = await generate_highchart_config.ainvoke(tool_args)
+            state["extra_context"][ref_key] = chart_config
+            return f"{chart_type} chart created **chart ref**: {ref_key}"
+
+        case "generate_dataset":
+            _user_request = tool_args.get("user_request", "")
+            job_id = await enqueue_dataset_job(state["session_id"], _user_request)
+            return {
+                "job_id": job_id,
+                "status": "queued",
+                "hint": ("Inform the user that the dataset is being created in the background, "
+                         "they will be notified once it is ready and can ask questions on it after that.")
+            }
+
+        case "nlp_to_chart":
+            _user_ques = tool_args["question"]
+            _args = {
+                "question":_user_ques,
+                "session_id": state["session_id"]
+            }
+            tool_args["question"] = dumps(_args)
+            result = await nlp_to_chart.ainvoke(tool_args)
+            if not isinstance(result, dict):
+                return result
+            if result["error"]:
+                return result["message"]
+            state["extra_context"][result["ref_key"]] = result["chart_config"]
+            return f"Chart generated sucessfully with ref key: {result['ref_key']}"
+
+        case _:
+            logger.warning("Unknown tool call received")
+            return f"Unknown tool {tool_name}"
+
+
+async def _run_tool_call(action, state: State, multiple: bool):
+    """ Runs a proposed action with its timeout and wraps the result in a ToolMessage """
+    tool_name = action.get("action")
+    tool_args = action.get("action_input") or {}
+    if not isinstance(tool_args, dict):
+        tool_args = {}
+    logger.info(f"Tool call: {tool_name} with args: {tool_args}")
+    timeout = state["budget"].timeout("tools", TOOL_TIMEOUTS.get(tool_name, TOOL_TIMEOUTS["default"]))
+    try:
+        with span(f"tool {tool_name}", timeout=timeout):
+            result = await asyncio.wait_for(call_tool(tool_name, tool_args, state), timeout)
+    except asyncio.TimeoutError:
+        logger.info(f"tool {tool_name} timed out after {timeout:.1f}s")
+        result = f"{tool_name} did not finish within {timeout:.0f} seconds"
+    except Exception as e:
+        logger.exception(f"error in tool {tool_name}: {e}")
+        result = f"{tool_name} failed: {e}"
+    observation = create_observation(result, tool_name if multiple else None)
+    return ToolMessage(content=observation, tool_call_id=str(uuid4()))
+
+
 @trace_call
 async def run_tools(state: State):
     try:
         last_msg = state["llm_context"][-1]
-        _resp = extract_json_from_string(last_msg.content)
-        _tool_call_id = str(uuid4())
-        tool_name = _resp.get("action")
-        tool_args = _resp.get("action_input", {})
-
-        logger.info(f"Tool call: {tool_name} with args: {tool_args}")
-
-        match tool_name:
-            case "nl_sql_agent":
-                tool_args["session_id"] = state["session_id"]
-                _tool_args = dumps(tool_args)
-                result = await nl_sql_agent.ainvoke((_tool_args))
-                tool_resp = ToolMessage(content=create_observation(result), tool_call_id=_tool_call_id)
-                state["llm_context"].append(tool_resp)
-
-            case "execute_query":
-                _tabel_mapping = get_tabel_mapping(state["session_id"])
-                tool_args["tabel_mapping"] = _tabel_mapping
-                _tool_args = dumps(tool_args)
-                df, metadata = await execute_query.ainvoke(_tool_args)
-                tool_resp = ToolMessage(content=create_observation(metadata), tool_call_id=_tool_call_id)
-                state["llm_context"].append(tool_resp)
-                if "error_message" not in metadata:
-                    ref_key = metadata["ref_key"]
-                    state["extra_context"][ref_key] = df
-
-            case "generate_highchart_config":
-                df_key = tool_args.pop("ref_key", "")
-                df = state["extra_context"].get(df_key)
-                if isinstance(df, dict):
-                    tool_args["ref_key"] = df
-                    chart_type = tool_args.get("chart_type","column")
-                    ref_key, chart_config = await generate_highchart_config.ainvoke(tool_args)
-                    state["extra_context"][ref_key] = chart_config
-                    ref_key = f"{chart_type} chart created **chart ref**: {ref_key}"
-                else:
-                    ref_key = "Unable to generate chart at the moment"
-                tool_resp = ToolMessage(content=create_observation(ref_key), tool_call_id=_tool_call_id)
-                state["llm_context"].append(tool_resp)
-
-            case "generate_dataset":
-                result = generate_dataset.invoke(tool_args)
-                if result.get("result"):
-                    msg = load_data_to_db(result["result"], result["dataset_info"], state["session_id"])
-                else:
-                    msg = result.get("error", "unable to generate dataset at the moment")
-                    msg += "<Instruction>Inform the user that you are currently unable to create a dataset.Politely suggest that they either upload an Excel file or allow you to attempt the task again.</Instruction>"
-                tool_resp = ToolMessage(content=create_observation(msg), tool_call_id=_tool_call_id)
-                state["llm_context"].append(tool_resp)
-
-            case "nlp_to_chart":
-                _user_ques = tool_args["question"]
-                _args = {
-                    "question":_user_ques,
-                    "session_id": state["session_id"]
-                }
-                tool_args["question"] = dumps(_args)
-                result = await nlp_to_chart.ainvoke(tool_args)
-                if result["error"]:
-                    msg = result["message"]
-                else:
-                    state["extra_context"][result["ref_key"]] = result["chart_config"]
-                    msg = f"Chart generated sucessfully with ref key: {result['ref_key']}"
-                tool_resp = ToolMessage(content=create_observation(msg), tool_call_id=_tool_call_id)
-                state["llm_context"].append(tool_resp)
-            case _:
-                logger.warning("Unknown tool call received")
+        _actions = get_actions(last_msg)
+        state["budget"].iterations += 1
+        tool_resps = await asyncio.gather(
+            *[_run_tool_call(action, state, len(_actions) > 1) for action in _actions]
+        )
+        state["llm_context"].extend(tool_resps)
 
     except Exception as e:
         logger.info(f"run_tools error: {e}")
     return state
 
 
+async def _stream_llm(llm, messages) -> AIMessage:
+    """
+    Streams the llm response through the incremental ReAct parser and stops
+    reading as soon as the json object is complete, so proposed actions are
+    dispatched without waiting for trailing text. The returned message is the
+    sum of the received chunks, native tool_calls included
+    """
+    parser = ReActStreamParser()
+    parsed = None
+    aggregate = None
+    stream = llm.astream(messages)
+    try:
+        async for chunk in stream:
+            # chunks are summed so native tool_calls and usage metadata are kept
+            aggregate = chunk if aggregate is None else aggregate + chunk
+            if parser.feed(chunk.content if isinstance(chunk.content, str) else ""):
+                parsed = parser.result()
+                if parsed is not None:
+                    logger.debug(f"react object complete after {parser.end} chars, closing stream")
+                    break
+    finally:
+        await stream.aclose()
+    if aggregate is None:
+        return AIMessage(content="")
+    message = message_chunk_to_message(aggregate)
+    if parsed is None:
+        logger.info(f"llm stream ended without a complete react object ({parser.length} chars, "
+                    f"{len(message.tool_calls)} tool calls)")
+        parsed = parse_json_object(message.content)
+    message.additional_kwargs[REACT_CACHE_KEY] = parsed
+    return message
+
+
 @trace_call
 async def chat_bot(state: State):
     try:
-        logger.info("---- extra_context ----")
-        logger.info(state["extra_context"])
-        logger.info("---- extra_context ----")
-
-        logger.info(f"query for llm ==> {state['llm_context'][-1]}")
+        logger.debug(f"extra_context keys --> {list(state['extra_context'])}")
+        logger.debug(f"query for llm ==> {state['llm_context'][-1].content}")
+        if state["budget"].expired():
+            logger.info("deadline reached, skipping llm call")
+            return state
         llm = get_llm_with_tools()
-        llm_resp = await llm.ainvoke(state["llm_context"])
+        with span("llm", model="llm", messages=len(state["llm_context"])):
+            llm_resp = await asyncio.wait_for(_stream_llm(llm, state["llm_context"]), state["budget"].timeout("chatbot"))
 
-        logger.info("---- llm_response ----")
-        logger.info(llm_resp)
-        logger.info("---- llm_response ----")
+        logger.debug(f"llm_response ==> {llm_resp.content}")
 
         state["llm_context"].append(llm_resp)
+    except asyncio.TimeoutError:
+        logger.info("chat_bot llm call timed out")
     except Exception as e:
         logger.info(f"chat_bot error: {e}")
     return state
 
 
+def _fallback_answer(state: State) -> str:
+    """ Static final answer referencing the charts generated so far """
+    _charts = "".join(f"<chart>{ref_key}</chart>" for ref_key in state["extra_context"])
+    _text = ("I could not complete this request within the time limit, here is what I could find so far."
+             if _charts else "I could not complete this request within the time limit, please try a simpler question.")
+    return dumps({
+        "thought": "The request budget is exhausted.",
+        "action": "final_answer",
+        "final_answer": f"<text>{_text}</text>{_charts}"
+    })
+
+
+@trace_call
+async def partial_answer(state: State):
+    """ Final answer from the observations gathered so far once the budget is used up """
+    content = None
+    budget = state["budget"]
+    try:
+        _remaining = budget.remaining()
+        if _remaining >= PARTIAL_ANSWER_MIN_SECONDS:
+            _context = state["llm_context"] + [HumanMessage(content=PARTIAL_ANSWER_PROMPT)]
+            _timeout = budget.timeout("partial_answer", _remaining - SAFETY_MARGIN)
+            llm_resp = await asyncio.wait_for(llm_plain.ainvoke(_context), _timeout)
+            _answer = extract_json_from_string(llm_resp.content)
+            if isinstance(_answer, dict) and _answer.get("final_answer"):
+                content = dumps({**_answer, "action": "final_answer"})
+        else:
+            logger.info(f"{_remaining:.1f}s left, skipping partial answer llm call")
+    except asyncio.TimeoutError:
+        logger.info("partial answer llm call timed out")
+    except Exception as e:
+        logger.info(f"partial_answer error: {e}")
+    state["llm_context"].append(AIMessage(content=content or _fallback_answer(state)))
+    return state
+
+
 # Build the graph
 graph_builder.add_node("chatbot", chat_bot)
 graph_builder.add_conditional_edges("chatbot", check_tools)
 graph_builder.add_node("tools", run_tools)
+graph_builder.add_node("partial_answer", partial_answer)
 
 graph_builder.add_edge(START, "chatbot")
 graph_builder.add_edge("tools", "chatbot")
+graph_builder.add_edge("partial_answer", END)
 graph_builder.add_edge("chatbot", END)
 
 graph = graph_builder.compile()
@@ -156,7 +307,9 @@ graph = graph_builder.compile()
 async def run_graph(state: State):
     """ Runs Graph """
     try:
-        result = await graph.ainvoke(state)
+        state.setdefault("budget", Budget())
+        state.setdefault("pending_sql", {})
+        result = await graph.ainvoke(state, config={"recursion_limit": RECURSION_LIMIT})
     except Exception as e:
         logger.exception(f"error in running graph {e}")
         result = "We are ancountering an issue at our end Please Try again later"
@@ -0,0 +1,185 @@
+import asyncio
+from datetime import datetime
+from json import loads, dumps
+from uuid import uuid4
+from library.cache_connect import get_redis, get_blocking_redis
+from library.tools import generate_dataset
+from library.utils import load_data_to_db
+from src.common import get_config
+from src.main_logger import logger
+
+_jobs_config = get_config("dataset_jobs") or {}
+
+MAX_CONCURRENT_JOBS = _jobs_config.get("max_concurrent", 2)
+JOB_TTL = _jobs_config.get("job_ttl", 86400)
+LEASE_TTL = _jobs_config.get("lease_ttl", 30)
+REAPER_INTERVAL = _jobs_config.get("reaper_interval", 30)
+MAX_ATTEMPTS = _jobs_config.get("max_attempts", 3)
+QUEUE_KEY = "dataset_jobs:queue"
+# jobs taken by a worker stay here until they finish, so a crashed worker does not lose them
+PROCESSING_KEY = "dataset_jobs:processing"
+
+_worker_tasks = []
+
+
+def _job_key(job_id):
+    return f"dataset_job:{job_id}"
+
+
+def _lease_key(job_id):
+    return f"dataset_job:{job_id}:lease"
+
+
+def session_channel(session_id):
+    """ Redis pub/sub channel used to push events to a session """
+    return f"{session_id}_events"
+
+
+async def _save_job(job, **updates):
+    job.update(updates, updated_on=datetime.utcnow().isoformat())
+    _redis = get_redis()
+    await _redis.set(_job_key(job["job_id"]), dumps(job), ex=JOB_TTL)
+    await _redis.publish(session_channel(job["session_id"]), dumps({"event": "dataset_job", "data": job}))
+    return job
+
+
+async def enqueue_dataset_job(session_id, user_request) -> str:
+    """ Queues a dataset generation job, returns the job id """
+    job = {
+        "job_id": str(uuid4()),
+        "session_id": session_id,
+        "user_request": user_request,
+        "created_on": datetime.utcnow().isoformat()
+    }
+    await _save_job(job, status="queued", result=None)
+    await get_redis().rpush(QUEUE_KEY, job["job_id"])
+    logger.info(f"dataset job queued {job['job_id']} for {session_id=}")
+    return job["job_id"]
+
+
+async def get_job(job_id) -> dict | None:
+    """ Returns a job record """
+    _job = await get_redis().get(_job_key(job_id))
+    return loads(_job) if _job else None
+
+
+async def run_dataset_job(job):
+    """ LLM code generation -> sandbox -> table load -> save dataset info """
+    await _save_job(job, status="running")
+    try:
+        result = await generate_dataset.ainvoke({"user_request": job["user_request"]})
+        if result.get("result"):
+            msg = await load_data_to_db(result["result"], result["dataset_info"], job["session_id"])
+            await _save_job(job, status="completed", result=msg)
+        else:
+            await _save_job(job, status="failed", result=result.get("error", "unable to generate dataset at the moment"))
+    except Exception as e:
+        logger.exception(f"error in running dataset job {e}")
+        await _save_job(job, status="failed", result="unable to generate dataset at the moment")
+
+
+async def _keep_lease(job_id):
+    """
+    Heartbeat of a running job, the reaper requeues jobs whose lease expired.
+    A failed refresh is logged and retried, the lease has LEASE_TTL to recover
+    """
+    while True:
+        try:
+            await get_redis().set(_lease_key(job_id), "1", ex=LEASE_TTL)
+            await asyncio.sleep(LEASE_TTL / 3)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(f"error in refreshing lease of dataset job {job_id} {e}")
+            await asyncio.sleep(1)
+
+
+async def _stop_lease(lease, job_id):
+    """ Cancels the heartbeat of a finished job, logs it when it had stopped on its own """
+    if lease.done() and not lease.cancelled() and lease.exception():
+        logger.error(f"lease heartbeat of dataset job {job_id} stopped {lease.exception()}")
+    lease.cancel()
+    await asyncio.gather(lease, return_exceptions=True)
+
+
+async def _worker_loop(worker_id):
+    """ Moves job ids from the queue to the processing list and runs them one at a time """
+    _blocking_redis = get_blocking_redis()
+    while True:
+        try:
+            job_id = await _blocking_redis.blmove(QUEUE_KEY, PROCESSING_KEY, 5, "LEFT", "RIGHT")
+            if not job_id:
+                continue
+            job = await get_job(job_id)
+            if job:
+                logger.info(f"dataset worker {worker_id} picked job {job_id}")
+                lease = asyncio.create_task(_keep_lease(job_id))
+                try:
+                    await run_dataset_job(job)
+                finally:
+                    await _stop_lease(lease, job_id)
+            # not reached when the worker is cancelled mid job, the reaper requeues it
+            _redis = get_redis()
+            await _redis.lrem(PROCESSING_KEY, 1, job_id)
+            await _redis.delete(_lease_key(job_id))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(f"error in dataset worker {worker_id} {e}")
+            await asyncio.sleep(1)
+
+
+async def _requeue(job_id):
+    """ Puts a job of a dead worker back on the queue, fails it after MAX_ATTEMPTS """
+    _redis = get_redis()
+    if not await _redis.lrem(PROCESSING_KEY, 1, job_id):
+        return  # finished or requeued by another node meanwhile
+    job = await get_job(job_id)
+    if not job:
+        return
+    attempts = job.get("attempts", 1)
+    if attempts >= MAX_ATTEMPTS:
+        logger.info(f"dataset job {job_id} failed after {attempts} attempts")
+        await _save_job(job, status="failed", result="unable to generate dataset at the moment")
+        return
+    logger.info(f"requeuing dataset job {job_id} (attempt {attempts + 1})")
+    await _save_job(job, status="queued", attempts=attempts + 1)
+    await _redis.rpush(QUEUE_KEY, job_id)
+
+
+async def _reaper_loop():
+    """
+    Requeues processing jobs without a lease. A job has to be seen without lease
+    on two passes, a worker sets the lease right after taking the job
+    """
+    suspects = set()
+    while True:
+        try:
+            await asyncio.sleep(REAPER_INTERVAL)
+            _redis = get_redis()
+            _orphans = set()
+            for job_id in await _redis.lrange(PROCESSING_KEY, 0, -1):
+                if not await _redis.exists(_lease_key(job_id)):
+                    _orphans.add(job_id)
+            for job_id in _orphans & suspects:
+                await _requeue(job_id)
+            suspects = _orphans - suspects
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(f"error in dataset job reaper {e}")
+
+
+def start_dataset_workers(concurrency=MAX_CONCURRENT_JOBS):
+    """ Starts the dataset job workers, concurrency caps generations on this node """
+    for worker_id in range(concurrency):
+        _worker_tasks.append(asyncio.create_task(_worker_loop(worker_id)))
+    _worker_tasks.append(asyncio.create_task(_reaper_loop()))
+    logger.info(f"started {concurrency} dataset job workers")
+
+
+async def stop_dataset_workers():
+    for task in _worker_tasks:
+        task.cancel()
+    await asyncio.gather(*_worker_tasks, return_exceptions=True)
+    _worker_tasks.clear()
@@ -0,0 +1,143 @@
+import time
+from collections import OrderedDict
+from json import loads, dumps
+from library.cache_connect import get_redis, NOT_FETCHED
+from sqlalchemy import select
+from library.db_connect import async_session_scope
+from library.models import Dataset, ChatThread
+from src.common import get_config
+from src.main_logger import logger
+
+_cache_config = get_config("metadata_cache") or {}
+
+MAX_SESSIONS = _cache_config.get("max_sessions", 1024)
+LOCAL_TTL = _cache_config.get("local_ttl", 30)
+REDIS_TTL = _cache_config.get("redis_ttl", 3600)
+
+# session_id -> (expires_at, generation, metadata), kept in LRU order
+_local_cache: OrderedDict = OrderedDict()
+
+
+def metadata_key(session_id):
+    return f"{session_id}_dataset_metadata"
+
+
+def generation_key(session_id):
+    """ Bumped on every invalidation, cached metadata of an older generation is never served """
+    return f"{session_id}_dataset_metadata_gen"
+
+
+async def _load_session_metadata(session_id):
+    """ Loads dataset flag, ddls and tabel mapping of a session in one query """
+    metadata = {"has_dataset": False, "ddls": {}, "tabel_mapping": {}}
+    _query = select(
+        ChatThread.dataset_id,
+        Dataset.dataset_metadata
+    ).outerjoin(
+        Dataset, Dataset.dataset_id == ChatThread.dataset_id
+    ).where(
+        ChatThread.session_uuid == session_id,
+        ChatThread.is_active == True
+    ).limit(1)
+    async with async_session_scope() as session:
+        row = (await session.execute(_query)).first()
+
+    if row and row.dataset_id is not None:
+        _dataset_metadata = row.dataset_metadata or {}
+        metadata = {
+            "has_dataset": True,
+            "ddls": _dataset_metadata.get("ddls", {}),
+            "tabel_mapping": _dataset_metadata.get("tabel_mapping", {})
+        }
+    return metadata
+
+
+def _get_local(session_id, generation):
+    """ Local entry when it is fresh and of the given generation (None: redis unavailable, not checked) """
+    _entry = _local_cache.get(session_id)
+    if not _entry:
+        return None
+    expires_at, _generation, metadata = _entry
+    if expires_at < time.monotonic() or (generation is not None and _generation != generation):
+        _local_cache.pop(session_id, None)
+        return None
+    _local_cache.move_to_end(session_id)
+    return metadata
+
+
+def _set_local(session_id, generation, metadata):
+    _local_cache[session_id] = (time.monotonic() + LOCAL_TTL, generation, metadata)
+    _local_cache.move_to_end(session_id)
+    while len(_local_cache) > MAX_SESSIONS:
+        _local_cache.popitem(last=False)
+
+
+def prefetch_commands(session_id) -> list:
+    """
+    Redis reads of get_session_metadata, for callers batching them with other reads.
+    With a local entry only the generation is read, the cached value would be thrown away
+    """
+    commands = [("GET", generation_key(session_id))]
+    if _get_local(session_id, None) is None:
+        commands.append(("GET", metadata_key(session_id)))
+    return commands
+
+
+async def get_session_metadata(session_id, prefetched=NOT_FETCHED) -> dict:
+    """
+    Returns session dataset metadata -> {"has_dataset", "ddls", "tabel_mapping"}
+    Looks up the in process LRU first, then redis, then mysql, entries of an
+    older generation (invalidated) are skipped.
+    `prefetched` are the replies of prefetch_commands when the caller batched them
+    """
+    _redis = get_redis()
+    generation, cached = None, NOT_FETCHED
+    try:
+        if prefetched is NOT_FETCHED:
+            prefetched = await _redis.mget([key for _, key in prefetch_commands(session_id)])
+        generation = int(prefetched[0] or 0)
+        cached = prefetched[1] if len(prefetched) > 1 else NOT_FETCHED
+    except Exception as e:
+        logger.exception(f"error in reading metadata generation {e}")
+
+    metadata = _get_local(session_id, generation)
+    if metadata is not None:
+        return metadata
+
+    try:
+        if cached is NOT_FETCHED:
+            cached = await _redis.get(metadata_key(session_id))
+        _entry = loads(cached) if cached else None
+        if _entry and _entry.get("generation") == generation:
+            _set_local(session_id, generation, _entry["metadata"])
+            return _entry["metadata"]
+    except Exception as e:
+        logger.exception(f"error in reading metadata cache {e}")
+
+    metadata = await _load_session_metadata(session_id)
+    logger.info(f"loaded dataset metadata from db for {session_id=}")
+    _set_local(session_id, generation, metadata)
+    if generation is None:
+        return metadata
+    try:
+        # an invalidation during the db load makes this value stale, do not cache it
+        if int(await _redis.get(generation_key(session_id)) or 0) == generation:
+            await _redis.set(metadata_key(session_id), dumps({"generation": generation, "metadata": metadata}),
+                             ex=REDIS_TTL)
+    except Exception as e:
+        logger.exception(f"error in writing metadata cache {e}")
+    return metadata
+
+
+async def invalidate_session_metadata(session_id):
+    """ Drops cached metadata of a session, the new generation also retires local entries of other workers """
+    _local_cache.pop(session_id, None)
+    try:
+        async with get_redis().pipeline(transaction=True) as pipe:
+            pipe.incr(generation_key(session_id))
+            pipe.expire(generation_key(session_id), REDIS_TTL)
+            pipe.delete(metadata_key(session_id))
+            await pipe.execute()
+        logger.info(f"metadata cache invalidated for {session_id=}")
+    except Exception as e:
+        logger.exception(f"error in invalidating metadata cache {e}")
@@ -0,0 +1,101 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from prometheus_client import (Counter, Histogram, CollectorRegistry, CONTENT_TYPE_LATEST,
+                               generate_latest, REGISTRY)
+from prometheus_client import multiprocess
+from langchain_core.callbacks import BaseCallbackHandler
+
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+
+NODE_DURATION = Histogram(
+    "chatbot_node_duration_seconds", "Duration of traced graph nodes, tools and functions",
+    ["name", "status"], buckets=SLOW_BUCKETS
+)
+HTTP_DURATION = Histogram(
+    "chatbot_http_request_duration_seconds", "Duration of http requests",
+    ["method", "route", "status"], buckets=SLOW_BUCKETS
+)
+LLM_DURATION = Histogram(
+    "chatbot_llm_call_duration_seconds", "Duration of llm calls",
+    ["model", "status"], buckets=SLOW_BUCKETS
+)
+LLM_TOKENS = Counter(
+    "chatbot_llm_tokens_total", "Tokens used by llm calls", ["model", "kind"]
+)
+SQL_DURATION = Histogram(
+    "chatbot_sql_duration_seconds", "Duration of dataset queries on the query engine",
+    ["engine", "status"], buckets=FAST_BUCKETS + SLOW_BUCKETS[6:]
+)
+SQL_ROWS = Histogram(
+    "chatbot_sql_result_rows", "Rows returned by dataset queries",
+    buckets=(1, 10, 100, 1_000, 10_000, 100_000, 1_000_000)
+)
+REDIS_DURATION = Histogram(
+    "chatbot_redis_command_duration_seconds", "Duration of redis commands",
+    ["command"], buckets=FAST_BUCKETS
+)
+MYSQL_DURATION = Histogram(
+    "chatbot_mysql_statement_duration_seconds", "Duration of mysql statements",
+    ["statement"], buckets=FAST_BUCKETS
+)
+SANDBOX_DURATION = Histogram(
+    "chatbot_sandbox_run_duration_seconds", "Duration of sandbox code runs",
+    ["outcome"], buckets=SLOW_BUCKETS
+)
+
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """ Records latency and token usage of the llm calls of one model """
+
+    # a run cancelled by asyncio.wait_for can skip both the end and error callbacks
+    MAX_OPEN_RUNS = 1000
+
+    def __init__(self, model: str):
+        self.model = model
+        self._started = OrderedDict()
+
+    def _start(self, run_id):
+        self._started[run_id] = time.perf_counter()
+        if len(self._started) > self.MAX_OPEN_RUNS:
+            # oldest first, a run open that long was abandoned
+            self._started.popitem(last=False)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def _observe(self, run_id, status):
+        start = self._started.pop(run_id, None)
+        if start is not None:
+            LLM_DURATION.labels(self.model, status).observe(time.perf_counter() - start)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._observe(run_id, "ok")
+        usage = {}
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or usage
+        if not usage:
+            _token_usage = (response.llm_output or {}).get("token_usage", {})
+            usage = {"input_tokens": _token_usage.get("prompt_tokens", 0),
+                     "output_tokens": _token_usage.get("completion_tokens", 0)}
+        LLM_TOKENS.labels(self.model, "prompt").inc(usage.get("input_tokens", 0))
+        LLM_TOKENS.labels(self.model, "completion").inc(usage.get("output_tokens", 0))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        # a stream closed early (ReAct object complete) or a cancelled call is not a failure
+        self._observe(run_id, "stopped" if isinstance(error, (GeneratorExit, asyncio.CancelledError)) else "error")
+
+
+def metrics_payload():
+    """ Returns (body, content type) of the /metrics response, supports multi process workers """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
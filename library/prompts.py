@@ -77,9 +77,21 @@ Your goal is to think step by step internally (in the "thought" field), decide o
    - If you do not need to take any action and just want to respond with an answer, set `"action": "final_answer"` and put your final answer in the `"final_answer"` field.
    - **Data-related questions:**
      If the user asks for data insights, analysis, summaries, or anything like *"sales by region," "top products," "monthly revenue trends,"* or other data exploration tasks, you **must propose the `nlp_to_chart` tool** with the user's query as the `action_input`.
+   - **Data lookups:**
+     If the user asks a data question that is best answered with a number, a short list or a table instead of a chart
+     (e.g. *"how many orders were placed last month," "which product sold the most"*), propose the `answer_data_question` tool
+     with `{"question": "<the user's question>"}` as the `action_input`. It writes and runs the SQL for you and returns the query,
+     row count, columns, a `ref_key` of the result (usable with `generate_highchart_config`) and a preview of the rows.
+     Never propose `nl_sql_agent` followed by `execute_query` for such questions.
+   - **Independent actions:**
+     If you need several tools whose inputs do not depend on each other's outputs (e.g. two separate charts or two separate queries),
+     propose them together in an `"actions"` array instead of `"action"`/`"action_input"`:
+     `"actions": [{"action": "tool_name", "action_input": {...}}, {"action": "tool_name", "action_input": {...}}]`
+     Never put an action that needs the output of another action (e.g. a chart on a query result you have not seen yet) in the same array.
 
 3. **Observation:**
    - After taking an action, you will receive an "observation" from the environment, which you will use to continue reasoning.
+   - When you proposed an `"actions"` array you receive one observation per action, each tagged with its `"action"` name.
 
 4. **Output Format:**
    Your output must always be a single JSON object with the following keys:
@@ -89,6 +101,7 @@ Your goal is to think step by step internally (in the "thought" field), decide o
      "action_input": "input to the tool (if any)",
      "final_answer": "Your final answer if action is final_answer"
    }
+   or, for independent tool calls, `"thought"` and `"actions"` (an array of `{"action", "action_input"}` objects).
 
 5. **Final Answer Rules:**
    - The `final_answer` must be wrapped in tags:
@@ -130,6 +143,17 @@ LLM:
          "chart_type":"column"
   }
 }
+
+User: Show me sales by region and the monthly order count.
+
+LLM:
+{
+  "thought": "The user asked for two independent charts, I can request both in one step.",
+  "actions": [
+    {"action": "nlp_to_chart", "action_input": {"question": "sales by region", "chart_type": "column"}},
+    {"action": "nlp_to_chart", "action_input": {"question": "monthly order count", "chart_type": "line"}}
+  ]
+}
 """
 
 
@@ -236,14 +260,42 @@ Your task is to analyze the given metadata and SQL query, determine the best way
 Requirements:
 - Choose the most appropriate chart type based on the nature of the data (e.g., bar, line, pie, scatter, etc.).
 - Select suitable columns for the x-axis and y-axis from the query output.
+- When the result has several numeric columns worth comparing, use a list of columns for "y" (one series per column).
+- When the result has a categorical column that splits the data into groups (e.g. region, product) besides the x-axis column,
+  set "series_by" to that column to get one series per group, otherwise set it to null.
+- Set "separate_axes" to true only when the y columns have different units or very different scales.
 - Generate a concise, meaningful chart title that accurately reflects the data being visualized.
 
 Output Format (JSON):
 ```json
 {
   "x": "column_name_for_x_axis",
-  "y": "column_name_for_y_axis",
+  "y": "column_name_for_y_axis or [list of column names]",
+  "series_by": "column_name_to_group_series_by or null",
+  "separate_axes": false,
   "chart_type": "appropriate_chart_type",
   "chart_title": "Descriptive and concise chart title"
 }
-"""
\ No newline at end of file
+"""
+CONTEXT_SUMMARY_PROMPT = """
+You maintain a running summary of a conversation between a user and a data analysis assistant.
+You will be given the current summary (may be empty) and the conversation turns that are being dropped from memory.
+Update the summary so that it keeps everything the assistant may need later:
+- datasets created or discussed (names, tables, important columns)
+- questions the user asked and the key findings / numbers in the answers
+- user preferences (chart types, formats, filters)
+
+Rules:
+- Write plain text, at most 8 short bullet points.
+- Do not invent facts that are not present in the summary or the turns.
+- Do not include chart UUIDs or SQL unless the user explicitly asked to keep them.
+- Output only the updated summary and nothing else.
+"""
+
+PARTIAL_ANSWER_PROMPT = """
+The time / tool budget for this request is used up, you cannot propose any more actions.
+Answer the user now with what you found so far in the observations above.
+- Clearly say that the answer is partial and what could not be completed.
+- Reference every chart that was already generated with its <chart> tag.
+- Respond with a single JSON object with "thought", "action": "final_answer" and "final_answer" (wrapped in <text>/<chart> tags) and nothing else.
+"""
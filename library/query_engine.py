@@ -0,0 +1,191 @@
+import os
+import re
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+import pandas as pd
+from sqlglot import parse_one, transpile, exp
+from src.common import get_config
+from src.main_logger import logger
+
+_engine_config = get_config("query_engine") or {}
+
+ENGINE = _engine_config.get("engine", "sqlite")
+SQLITE_PATH = _engine_config.get("sqlite_path", "local_db.sqlite")
+PARQUET_DIR = _engine_config.get("parquet_dir", "datasets")
+SQLITE_MMAP_SIZE = _engine_config.get("sqlite_mmap_size", 256 * 1024 * 1024)
+SQLITE_CACHE_SIZE = _engine_config.get("sqlite_cache_size", -64 * 1024)
+SQLITE_BUSY_TIMEOUT_MS = _engine_config.get("sqlite_busy_timeout_ms", 5000)
+SQLITE_CACHED_STATEMENTS = _engine_config.get("sqlite_cached_statements", 256)
+
+_DUCKDB_TYPES = {
+    "TINYINT": "INTEGER", "SMALLINT": "INTEGER", "INTEGER": "INTEGER", "BIGINT": "INTEGER",
+    "HUGEINT": "INTEGER", "FLOAT": "REAL", "DOUBLE": "REAL", "BOOLEAN": "INTEGER",
+    "VARCHAR": "TEXT", "DATE": "DATE", "TIMESTAMP": "TIMESTAMP", "TIMESTAMP_NS": "TIMESTAMP"
+}
+
+
+class QueryEngine(ABC):
+    """
+    Storage/query layer behind execute_query, load_data_to_db and get_table_ddl.
+    Queries are written in the sqlite dialect (NL_SQL_PROMPT), engines
+    transpile them when needed.
+    """
+    name = ""
+
+    @abstractmethod
+    def load_table(self, table: str, df: pd.DataFrame):
+        """ Stores a dataframe as a new physical table """
+
+    @abstractmethod
+    def get_table_ddl(self, table: str) -> str | None:
+        """ Returns CREATE TABLE ddl of a physical table """
+
+    @abstractmethod
+    def run_query(self, sql: str) -> pd.DataFrame:
+        """ Runs a (sqlite dialect) query """
+
+
+class SQLiteEngine(QueryEngine):
+    """
+    Row store, all datasets in one sqlite file.
+    The file runs in WAL mode with one dedicated writer connection and a
+    read-only connection per thread, so analytic reads do not wait on
+    dataset loads and no connection is opened per query.
+    """
+    name = "sqlite"
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._writer = self._connect(read_only=False)
+
+    def _connect(self, read_only):
+        if read_only:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False,
+                                   cached_statements=SQLITE_CACHED_STATEMENTS)
+            conn.execute("PRAGMA query_only=ON")
+        else:
+            conn = sqlite3.connect(self.path, check_same_thread=False,
+                                   cached_statements=SQLITE_CACHED_STATEMENTS)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+        return conn
+
+    def _reader(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect(read_only=True)
+        return conn
+
+    def load_table(self, table, df):
+        with self._write_lock:
+            df.to_sql(table, self._writer, index=False, if_exists="fail")
+
+    def get_table_ddl(self, table):
+        ddl = self._reader().execute(
+            "SELECT sql FROM sqlite_master WHERE type='table' AND name=?;", (table,)
+        ).fetchone()
+        return ddl[0] if ddl else None
+
+    def run_query(self, sql):
+        return pd.read_sql_query(sql, self._reader())
+
+
+class DuckDBEngine(QueryEngine):
+    """ Columnar engine, one parquet file per table queried through duckdb """
+    name = "duckdb"
+
+    def __init__(self, parquet_dir=PARQUET_DIR):
+        import duckdb
+        self._duckdb = duckdb
+        self.parquet_dir = parquet_dir
+        os.makedirs(parquet_dir, exist_ok=True)
+        self._local = threading.local()
+
+    def _connection(self):
+        # duckdb connections are not thread safe, one in-memory connection per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._duckdb.connect()
+        return conn
+
+    def _query_connection(self):
+        """
+        Per thread connection for generated sql, files outside the parquet dir
+        can not be read or written and the settings are locked
+        """
+        conn = getattr(self._local, "query_conn", None)
+        if conn is None:
+            conn = self._duckdb.connect()
+            _allowed = os.path.abspath(self.parquet_dir).replace("'", "''") + os.sep
+            conn.execute(f"SET allowed_directories=['{_allowed}']")
+            conn.execute("SET enable_external_access=false")
+            conn.execute("SET lock_configuration=true")
+            self._local.query_conn = conn
+        return conn
+
+    def _path(self, table):
+        if not re.fullmatch(r"\w+", table):
+            raise ValueError(f"invalid table name {table}")
+        return os.path.join(self.parquet_dir, f"{table}.parquet")
+
+    def load_table(self, table, df):
+        path = self._path(table)
+        if os.path.exists(path):
+            raise ValueError(f"Table '{table}' already exists.")
+        conn = self._connection()
+        conn.register("_load_df", df)
+        try:
+            conn.execute(f"COPY (SELECT * FROM _load_df) TO '{path}' (FORMAT PARQUET)")
+        finally:
+            conn.unregister("_load_df")
+
+    def get_table_ddl(self, table):
+        path = self._path(table)
+        if not os.path.exists(path):
+            return None
+        columns = self._connection().execute(
+            f"SELECT column_name, column_type FROM (DESCRIBE SELECT * FROM read_parquet('{path}'))"
+        ).fetchall()
+        _columns = ",\n".join(f'"{name}" {_DUCKDB_TYPES.get(_type, _type)}' for name, _type in columns)
+        return f'CREATE TABLE "{table}" (\n{_columns}\n)'
+
+    def run_query(self, sql):
+        ast = parse_one(sql, read="sqlite")
+        # COPY / SET / ATTACH can still write inside the parquet dir, table functions read files
+        if not isinstance(ast, exp.Query):
+            raise ValueError("Only SELECT queries are allowed.")
+        if any(not isinstance(t.this, exp.Identifier) for t in ast.find_all(exp.Table)):
+            raise ValueError("Table functions are not allowed.")
+        conn = self._query_connection()
+        for table in {t.name for t in ast.find_all(exp.Table)}:
+            if not re.fullmatch(r"\w+", table):
+                continue
+            path = self._path(table)
+            if os.path.exists(path):
+                conn.execute(f"CREATE OR REPLACE VIEW \"{table}\" AS SELECT * FROM read_parquet('{path}')")
+        _sql = transpile(sql, read="sqlite", write="duckdb")[0]
+        return conn.execute(_sql).df()
+
+
+_ENGINES = {
+    SQLiteEngine.name: SQLiteEngine,
+    DuckDBEngine.name: DuckDBEngine
+}
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_query_engine() -> QueryEngine:
+    """ Returns the configured query engine (query_engine.engine, default sqlite) """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = _ENGINES[ENGINE]()
+            logger.info(f"using {_engine.name} query engine")
+    return _engine
@@ -0,0 +1,199 @@
+import re
+from json import JSONDecoder, JSONDecodeError
+
+# parsed ReAct json of an AIMessage, kept in additional_kwargs so a message is parsed once
+REACT_CACHE_KEY = "react_parsed"
+
+_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_IDENTIFIER = re.compile(r"[A-Za-z_]\w*")
+# the only characters the brace scan has to look at, everything else is skipped in C
+_SPECIAL = re.compile(r"[{}\"'\\]")
+_decoder = JSONDecoder()
+
+
+class _BraceScanner:
+    """ Balanced brace state machine (string and escape aware), state is kept across chunks """
+
+    def __init__(self):
+        self.depth = 0
+        self.quote = None
+        self.escaped = False
+
+    def scan(self, text: str, pos: int = 0) -> int:
+        """ Consumes text from pos, returns the index after the closing brace of the object or -1 """
+        if self.escaped:
+            self.escaped = False
+            pos += 1
+        length = len(text)
+        while pos < length:
+            match = _SPECIAL.search(text, pos)
+            if match is None:
+                return -1
+            char, pos = match.group(), match.end()
+            if self.quote:
+                if char == "\\":
+                    self.escaped = pos == length
+                    pos += 1
+                elif char == self.quote:
+                    self.quote = None
+            elif char in "\"'":
+                self.quote = char
+            elif char == "{":
+                self.depth += 1
+            elif char == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    return pos
+        return -1
+
+
+def find_json_object(text: str, start: int = 0):
+    """
+    Single pass balanced brace scan
+    Returns:
+        (start, end) of the first complete {...} object, end exclusive, or None
+    """
+    begin = text.find("{", start)
+    if begin == -1:
+        return None
+    end = _BraceScanner().scan(text, begin)
+    return (begin, end) if end != -1 else None
+
+
+def repair_json(candidate: str) -> str:
+    """
+    Fixes common llm json defects in one pass: single quoted strings, python
+    literals (True/False/None), trailing commas and raw newlines/tabs in strings
+    """
+    out = []
+    quote, escaped = None, False
+    pending_comma = False
+    pos, length = 0, len(candidate)
+    while pos < length:
+        char = candidate[pos]
+        if quote:
+            if escaped:
+                escaped = False
+                # \' is not a json escape
+                out.append("'" if char == "'" else "\\" + char)
+            elif char == "\\":
+                escaped = True
+            elif char == quote:
+                quote = None
+                out.append('"')
+            elif char == '"':
+                out.append('\\"')
+            elif char == "\n":
+                out.append("\\n")
+            elif char == "\t":
+                out.append("\\t")
+            elif char == "\r":
+                out.append("\\r")
+            else:
+                out.append(char)
+            pos += 1
+            continue
+
+        if char.isspace():
+            out.append(char)
+            pos += 1
+            continue
+        if pending_comma:
+            pending_comma = False
+            if char not in "}]":
+                out.append(",")
+        if char == ",":
+            pending_comma = True
+        elif char in "\"'":
+            quote = char
+            out.append('"')
+        elif char.isalpha() or char == "_":
+            match = _IDENTIFIER.match(candidate, pos)
+            out.append(_LITERALS.get(match.group(), match.group()))
+            pos = match.end()
+            continue
+        else:
+            out.append(char)
+        pos += 1
+    return "".join(out)
+
+
+def parse_json_object(text: str):
+    """
+    Parses the first json object in a text (code fences / surrounding prose are ignored)
+    Returns:
+        dict, or None when there is no parsable object
+    """
+    if not isinstance(text, str):
+        return None
+    begin = text.find("{")
+    if begin == -1:
+        return None
+    try:
+        # valid json: one C level pass, trailing text is ignored
+        return _decoder.raw_decode(text, begin)[0]
+    except JSONDecodeError:
+        pass
+    span = find_json_object(text, begin)
+    if span is None:
+        return None
+    try:
+        return _decoder.decode(repair_json(text[span[0]:span[1]]))
+    except JSONDecodeError:
+        return None
+
+
+def parse_message(message):
+    """ Parsed ReAct json of an AIMessage, cached on the message """
+    _kwargs = message.additional_kwargs
+    if REACT_CACHE_KEY not in _kwargs:
+        _kwargs[REACT_CACHE_KEY] = parse_json_object(message.content)
+    return _kwargs[REACT_CACHE_KEY]
+
+
+class ReActStreamParser:
+    """
+    Incremental balanced brace scan over streamed llm tokens, every chunk is
+    scanned once. `complete` turns True as soon as the first json object closes,
+    so a proposed action can be dispatched without waiting for trailing text.
+    """
+
+    def __init__(self):
+        self.buffer = []
+        self.length = 0
+        self.begin = None
+        self.end = None
+        self._scanner = _BraceScanner()
+
+    @property
+    def complete(self) -> bool:
+        return self.end is not None
+
+    def feed(self, chunk: str) -> bool:
+        """ Adds a chunk, returns True once the first object is complete """
+        if self.complete or not chunk:
+            return self.complete
+        offset = self.length
+        self.buffer.append(chunk)
+        self.length += len(chunk)
+        pos = 0
+        if self.begin is None:
+            pos = chunk.find("{")
+            if pos == -1:
+                return False
+            self.begin = offset + pos
+        end = self._scanner.scan(chunk, pos)
+        if end != -1:
+            self.end = offset + end
+        return self.complete
+
+    @property
+    def text(self) -> str:
+        """ Everything received so far """
+        return "".join(self.buffer)
+
+    def result(self):
+        """ Parsed first object, None until complete or when it can not be parsed """
+        if not self.complete:
+            return None
+        return parse_json_object(self.text[self.begin:self.end])
@@ -3,9 +3,27 @@ from src.main_logger import logger
 
 sql_query = "SELECT region, SUM(sales_amount) AS total_sales FROM sales_data GROUP BY region"
 
-def replace_table_names(sql: str, table_mapping: dict) -> str:
+
+def _canonical(ast) -> str:
+    # normalize lowercases aliases, the projections keep the output column names in the key
+    _projections = ", ".join(select.sql() for select in ast.selects)
+    return f"{ast.sql(normalize=True, comments=False)}\n{_projections}"
+
+
+def canonical_sql(sql: str) -> str:
+    """ Canonical form of a query (as in resolve_query), the stripped sql when it does not parse """
+    try:
+        return _canonical(parse_one(sql))
+    except Exception:
+        return str(sql).strip()
+
+def resolve_query(sql: str, table_mapping: dict):
     """
     replaces actual tabel names
+    Returns:
+        resolved sql, set of physical tables used, canonical sql (normalized
+        identifiers/whitespace, no comments, plus the output column names)
+        usable as a cache key
     """
     try:
         logger.info(f"original sql -> {sql}")
@@ -14,16 +32,21 @@ def replace_table_names(sql: str, table_mapping: dict) -> str:
         ast = parse_one(sql)
 
         # Replace table names
+        tables = set()
         for table in ast.find_all(exp.Table):
             original_name = table.name
             if original_name.lower() in table_mapping:
                 table.set("this", exp.to_identifier(table_mapping[original_name.lower()]))
+            tables.add(table.name)
 
-        return ast.sql()
+        return ast.sql(), tables, _canonical(ast)
     except Exception as e:
         logger.exception(f"error in replacing tabel names {e}")
-    return sql
-
-
+    return sql, set(), None
 
 
+def replace_table_names(sql: str, table_mapping: dict) -> str:
+    """
+    replaces actual tabel names
+    """
+    return resolve_query(sql, table_mapping)[0]
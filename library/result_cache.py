@@ -0,0 +1,171 @@
+from collections import OrderedDict
+from hashlib import sha1
+import msgpack
+import numpy as np
+import pandas as pd
+from library.cache_connect import get_binary_redis
+from src.common import get_config
+from src.main_logger import logger
+
+_cache_config = get_config("result_cache") or {}
+
+MAX_BYTES = _cache_config.get("max_bytes", 256 * 1024 * 1024)
+MAX_ENTRY_BYTES = _cache_config.get("max_entry_bytes", 32 * 1024 * 1024)
+REDIS_SPILL = _cache_config.get("redis_spill", False)
+REDIS_MAX_ENTRY_BYTES = _cache_config.get("redis_max_entry_bytes", 8 * 1024 * 1024)
+REDIS_TTL = _cache_config.get("redis_ttl", 3600)
+
+# redis payload: magic, format version, then msgpack of
+# {"tables": [...], "rows": n, "columns": [[name, dtype, data], ...]}
+# numpy columns store their raw buffer, other columns a list of plain values
+MAGIC = 0xc2
+FORMAT_VERSION = 1
+# bool, int, uint, float, complex, timedelta, datetime, never object pointers
+_BUFFER_KINDS = "biufcmM"
+
+# key -> (df, size in bytes, physical tables), kept in LRU order
+_entries: OrderedDict = OrderedDict()
+_total_bytes = 0
+
+
+def result_cache_key(tables, canonical_sql) -> str | None:
+    """ Cache key from the physical table set and canonical sql """
+    if not canonical_sql:
+        return None
+    _raw = "|".join(sorted(tables)) + "\n" + canonical_sql
+    return sha1(_raw.encode()).hexdigest()
+
+
+def _redis_key(key):
+    return f"result_cache:v{FORMAT_VERSION}:{key}"
+
+
+def _redis_table_key(table):
+    return f"result_cache:table:{table}"
+
+
+def _frame_size(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def _encode_frame(df: pd.DataFrame, tables) -> bytes:
+    """ Columnar payload of a result, raises TypeError for values msgpack can not store """
+    columns = []
+    for name, column in zip(df.columns, (df.iloc[:, i] for i in range(df.shape[1]))):
+        dtype = column.dtype
+        if isinstance(dtype, np.dtype) and dtype.kind in _BUFFER_KINDS:
+            columns.append([name, dtype.str, np.ascontiguousarray(column.to_numpy()).tobytes()])
+        else:
+            columns.append([name, str(dtype), column.tolist()])
+    body = msgpack.packb({"tables": sorted(tables), "rows": len(df), "columns": columns})
+    return bytes((MAGIC, FORMAT_VERSION)) + body
+
+
+def _decode_frame(payload: bytes):
+    """ Rebuilds (df, tables) of a payload, raises ValueError for anything else """
+    if len(payload) < 2 or payload[0] != MAGIC or payload[1] != FORMAT_VERSION:
+        raise ValueError("unknown result cache format")
+    data = msgpack.unpackb(payload[2:])
+    if not isinstance(data, dict) or not isinstance(data.get("tables"), list) \
+            or not isinstance(data.get("rows"), int) or not isinstance(data.get("columns"), list):
+        raise ValueError("malformed result cache payload")
+    rows = data["rows"]
+    names, values = [], []
+    for name, dtype, column in data["columns"]:
+        if isinstance(column, bytes):
+            dtype = np.dtype(dtype)
+            if dtype.kind not in _BUFFER_KINDS or len(column) != rows * dtype.itemsize:
+                raise ValueError(f"invalid result cache column {name}")
+            values.append(np.frombuffer(column, dtype=dtype).copy())
+        elif isinstance(column, list) and len(column) == rows:
+            values.append(pd.array(column, dtype=pd.api.types.pandas_dtype(dtype)))
+        else:
+            raise ValueError(f"invalid result cache column {name}")
+        names.append(name)
+    # positional build, sql results can repeat a column name
+    df = pd.DataFrame(dict(enumerate(values)), index=pd.RangeIndex(rows))
+    df.columns = names
+    return df, set(data["tables"])
+
+
+def _drop(key):
+    global _total_bytes
+    _entry = _entries.pop(key, None)
+    if _entry:
+        _total_bytes -= _entry[1]
+
+
+def _set_local(key, df, tables, size):
+    global _total_bytes
+    _drop(key)
+    _entries[key] = (df, size, tables)
+    _total_bytes += size
+    while _total_bytes > MAX_BYTES and _entries:
+        _drop(next(iter(_entries)))
+
+
+async def get_cached_result(key) -> pd.DataFrame | None:
+    """ Looks up a cached result, in process first then redis (when spill is enabled) """
+    if not key:
+        return None
+    _entry = _entries.get(key)
+    if _entry:
+        _entries.move_to_end(key)
+        return _entry[0]
+
+    if not REDIS_SPILL:
+        return None
+    try:
+        _payload = await get_binary_redis().get(_redis_key(key))
+        if _payload:
+            df, tables = _decode_frame(_payload)
+            _set_local(key, df, tables, _frame_size(df))
+            return df
+    except Exception as e:
+        logger.exception(f"error in reading result cache {e}")
+    return None
+
+
+async def cache_result(key, df: pd.DataFrame, tables):
+    """ Caches a query result, results above MAX_ENTRY_BYTES are not cached """
+    if not key:
+        return
+    size = _frame_size(df)
+    if size > MAX_ENTRY_BYTES:
+        return
+    _set_local(key, df, set(tables), size)
+
+    if not REDIS_SPILL or size > REDIS_MAX_ENTRY_BYTES:
+        return
+    try:
+        _payload = _encode_frame(df, tables)
+    except (TypeError, ValueError) as e:
+        logger.debug(f"result not spilled to redis, unsupported values {e}")
+        return
+    try:
+        _redis = get_binary_redis()
+        async with _redis.pipeline(transaction=False) as pipe:
+            pipe.set(_redis_key(key), _payload, ex=REDIS_TTL)
+            for table in tables:
+                pipe.sadd(_redis_table_key(table), key)
+                pipe.expire(_redis_table_key(table), REDIS_TTL)
+            await pipe.execute()
+    except Exception as e:
+        logger.exception(f"error in writing result cache {e}")
+
+
+async def invalidate_tables(tables):
+    """ Drops cached results that read any of the given physical tables """
+    tables = set(tables)
+    for key in [key for key, (_, _, _tables) in _entries.items() if _tables & tables]:
+        _drop(key)
+
+    if not REDIS_SPILL:
+        return
+    try:
+        _redis = get_binary_redis()
+        for table in tables:
+            keys = await _redis.smembers(_redis_table_key(table))
+            await _redis.delete(_redis_table_key(table), *[_redis_key(key.decode()) for key in keys])
+    except Exception as e:
+        logger.exception(f"error in invalidating result cache {e}")
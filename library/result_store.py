@@ -0,0 +1,96 @@
+import os
+import pickle
+import tempfile
+from uuid import uuid4
+import pandas as pd
+from src.common import get_config
+from src.main_logger import logger
+
+_store_config = get_config("result_store") or {}
+
+MEMORY_BUDGET = _store_config.get("memory_budget_bytes", 64 * 1024 * 1024)
+SPILL_BYTES = _store_config.get("spill_bytes", 8 * 1024 * 1024)
+MAX_ROWS = _store_config.get("max_rows", 100_000)
+SPILL_DIR = _store_config.get("spill_dir", None)
+
+
+def to_columnar(df: pd.DataFrame) -> dict:
+    """ DataFrame -> {column: numpy array} """
+    return {column: df[column].to_numpy() for column in df.columns}
+
+
+class ResultStore:
+    """
+    Per request store of query results referenced by ref_key.
+    Results are kept as numpy columns, results above SPILL_BYTES or over the
+    request MEMORY_BUDGET are spilled to disk and loaded back on lookup.
+    """
+
+    def __init__(self, memory_budget=MEMORY_BUDGET, spill_bytes=SPILL_BYTES, max_rows=MAX_ROWS):
+        self.memory_budget = memory_budget
+        self.spill_bytes = spill_bytes
+        self.max_rows = max_rows
+        self.memory_used = 0
+        self._in_memory = {}
+        self._spilled = {}
+
+    def put(self, df: pd.DataFrame):
+        """
+        Stores a result
+        Returns:
+            ref_key, metadata for the llm (rows, columns, ref_key and truncation info)
+        """
+        ref_key = str(uuid4())
+        metadata = {
+            "rows": len(df),
+            "columns": list(df.columns),
+            "ref_key": ref_key
+        }
+        if len(df) > self.max_rows:
+            metadata.update({
+                "rows": self.max_rows,
+                "total_rows": len(df),
+                "truncated": True,
+                "note": f"Result was truncated to the first {self.max_rows} rows, use aggregations or filters for complete results"
+            })
+            df = df.head(self.max_rows)
+
+        size = int(df.memory_usage(index=False, deep=True).sum())
+        data = to_columnar(df)
+        if size > self.spill_bytes or self.memory_used + size > self.memory_budget:
+            self._spill(ref_key, data)
+        else:
+            self._in_memory[ref_key] = data
+            self.memory_used += size
+        return ref_key, metadata
+
+    def _spill(self, ref_key, data):
+        fd, path = tempfile.mkstemp(prefix="result_", suffix=".pkl", dir=SPILL_DIR)
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self._spilled[ref_key] = path
+        logger.info(f"result {ref_key} spilled to disk")
+
+    def get(self, ref_key) -> dict | None:
+        """ Returns {column: numpy array} of a stored result """
+        if ref_key in self._in_memory:
+            return self._in_memory[ref_key]
+        path = self._spilled.get(ref_key)
+        if path:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        return None
+
+    def __contains__(self, ref_key):
+        return ref_key in self._in_memory or ref_key in self._spilled
+
+    def close(self):
+        """ Frees results and removes spill files """
+        for path in self._spilled.values():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._spilled.clear()
+        self._in_memory.clear()
+        self.memory_used = 0
@@ -0,0 +1,227 @@
+import asyncio
+import multiprocessing
+import queue
+import resource
+import threading
+import time
+import traceback
+import pandas as pd
+import numpy as np
+from faker import Faker
+from src.common import get_config
+from src.main_logger import logger
+from library.metrics import SANDBOX_DURATION
+
+_sandbox_config = get_config("sandbox") or {}
+
+POOL_SIZE = _sandbox_config.get("pool_size", 2)
+MAX_JOBS_PER_WORKER = _sandbox_config.get("max_jobs", 20)
+MAX_RSS_MB = _sandbox_config.get("max_rss_mb", 1024)
+START_METHOD = _sandbox_config.get("start_method", "spawn")
+
+
+def _execute_code(code, variables_to_return, return_dict):
+    try:
+        fake = Faker()
+        allowed_globals = {
+            "__builtins__":{
+            # Basic types and constructors
+            "range": range,
+            "len": len,
+            "str": str,
+            "int": int,
+            "float": float,
+            "bool": bool,
+            "list": list,
+            "dict": dict,
+            "set": set,
+            "tuple": tuple,
+
+            # Iteration and functional programming
+            "enumerate": enumerate,
+            "zip": zip,
+            "map": map,
+            "filter": filter,
+            "sorted": sorted,
+            "any": any,
+            "all": all,
+
+            # Numeric utilities
+            "sum": sum,
+            "min": min,
+            "max": max,
+            "abs": abs,
+            "round": round,
+            "pow": pow,
+
+            # String utilities
+            "format": format,
+            "chr": chr,
+            "ord": ord,
+        },
+            "pd": pd,
+            "np": np,
+            "faker": fake,
+            "Faker": Faker,
+        }
+
+        local_vars = {}
+        exec(code, allowed_globals, local_vars)
+        if variables_to_return:
+            output = {var: local_vars.get(var, None) for var in variables_to_return}
+        else:
+            output = local_vars
+        return_dict["result"] = output
+
+    except Exception:
+        return_dict["error"] = traceback.format_exc()
+
+
+def _worker_loop(conn):
+    """ Sandbox worker, runs jobs received on the pipe until it gets None """
+    conn.send("ready")
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+        if job is None:
+            break
+
+        code, variables_to_return = job
+        result = {}
+        _execute_code(code, variables_to_return, result)
+        rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        try:
+            conn.send((result, rss_mb))
+        except Exception:
+            conn.send(({"error": traceback.format_exc()}, rss_mb))
+    conn.close()
+
+
+class SandboxWorker:
+    """ A warm worker process with pandas/numpy/faker already imported """
+
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_loop, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+        self.ready = False
+
+    def wait_ready(self):
+        """ Waits for the worker to finish its imports """
+        if not self.ready:
+            self.conn.recv()
+            self.ready = True
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+            self.process.join(1)
+        except Exception:
+            pass
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class SandboxPool:
+    """
+    Pool of pre-started sandbox workers.
+    Workers are recycled after MAX_JOBS_PER_WORKER jobs, when their RSS goes
+    over MAX_RSS_MB and when a job exceeds its timeout.
+    """
+
+    def __init__(self, size=POOL_SIZE, max_jobs=MAX_JOBS_PER_WORKER,
+                 max_rss_mb=MAX_RSS_MB, start_method=START_METHOD):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self._ctx = multiprocessing.get_context(start_method)
+        self._idle = queue.Queue()
+        self._closed = False
+
+    def start(self):
+        workers = [SandboxWorker(self._ctx) for _ in range(self.size)]
+        for worker in workers:
+            worker.wait_ready()
+            self._idle.put(worker)
+        logger.info(f"sandbox pool started with {self.size} workers")
+
+    def _replace(self, worker):
+        worker.kill()
+        return SandboxWorker(self._ctx)
+
+    def run(self, code: str, variables_to_return: list = None, timeout: int = 7) -> dict:
+        """ Runs code on a warm worker, returns {"result": ...} or {"error": ...} """
+        worker = self._idle.get()
+        outcome, start = "crashed", None
+        try:
+            worker.wait_ready()
+            start = time.perf_counter()
+            worker.conn.send((code, variables_to_return))
+            if not worker.conn.poll(timeout):
+                logger.info("sandbox job timed out, recycling worker")
+                outcome = "timeout"
+                worker = self._replace(worker)
+                return {"error": f"Code execution exceeded {timeout} seconds."}
+
+            result, rss_mb = worker.conn.recv()
+            outcome = "error" if "error" in result else "ok"
+            worker.jobs += 1
+            if worker.jobs >= self.max_jobs or rss_mb > self.max_rss_mb:
+                logger.info(f"recycling sandbox worker after {worker.jobs} jobs ({rss_mb:.0f} MB)")
+                worker = self._replace(worker)
+            return result
+        except (EOFError, OSError) as e:
+            logger.exception(f"sandbox worker died {e}")
+            worker = self._replace(worker)
+            return {"error": f"Sandbox worker crashed: {e}"}
+        finally:
+            if start is not None:
+                SANDBOX_DURATION.labels(outcome).observe(time.perf_counter() - start)
+            if self._closed:
+                worker.stop()
+            else:
+                self._idle.put(worker)
+
+    async def arun(self, code: str, variables_to_return: list = None, timeout: int = 7) -> dict:
+        """ Awaitable run, the blocking pipe wait happens off the event loop """
+        return await asyncio.to_thread(self.run, code, variables_to_return, timeout)
+
+    def shutdown(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
+        logger.info("sandbox pool stopped")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_sandbox_pool() -> SandboxPool:
+    """ Returns the process wide sandbox pool, starts it on first use """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SandboxPool()
+            _pool.start()
+    return _pool
+
+
+def shutdown_sandbox_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
@@ -0,0 +1,163 @@
+import math
+import re
+from collections import Counter, OrderedDict
+from hashlib import sha1
+from library.cache_connect import get_redis
+from src.common import get_config
+from src.main_logger import logger
+
+_cache_config = get_config("semantic_cache") or {}
+
+SIMILARITY_THRESHOLD = _cache_config.get("similarity_threshold", 0.9)
+MAX_ENTRIES = _cache_config.get("max_entries_per_dataset", 500)
+MAX_DATASETS = _cache_config.get("max_datasets", 256)
+REDIS_TTL = _cache_config.get("redis_ttl", 7 * 24 * 3600)
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9_]+")
+_NUMBER_PATTERN = re.compile(r"^\d+$")
+# filler only, logical (and/or) and grouping / filter words (by, in, for, ...) change the sql
+_STOP_WORDS = frozenset(
+    "a an the of is are was were be me my i we our us you "
+    "please show give get tell what which whats can could would list display".split()
+)
+
+
+def normalize_question(question: str) -> str:
+    """ Lower cases, strips punctuation and filler words """
+    return " ".join(tok for tok in _TOKEN_PATTERN.findall(question.lower()) if tok not in _STOP_WORDS)
+
+
+def ddl_fingerprint(ddl_text: str) -> str:
+    """ Fingerprint of the dataset schema the sql was generated for """
+    return sha1(ddl_text.encode()).hexdigest()
+
+
+def _terms(normalized: str) -> Counter:
+    tokens = normalized.split()
+    return Counter(tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])])
+
+
+def _numbers(normalized: str) -> set:
+    return {tok for tok in normalized.split() if _NUMBER_PATTERN.match(tok)}
+
+
+class _QuestionIndex:
+    """ TF-IDF nearest neighbour index of the questions asked on one dataset """
+
+    def __init__(self):
+        self.entries = OrderedDict()  # normalized question -> (terms, response)
+        self.doc_freq = Counter()
+
+    def add(self, normalized, response):
+        if normalized in self.entries:
+            self.entries[normalized] = (self.entries[normalized][0], response)
+            return
+        terms = _terms(normalized)
+        self.entries[normalized] = (terms, response)
+        self.doc_freq.update(terms.keys())
+        while len(self.entries) > MAX_ENTRIES:
+            _, (old_terms, _) = self.entries.popitem(last=False)
+            self.doc_freq.subtract(old_terms.keys())
+
+    def remove(self, normalized):
+        _entry = self.entries.pop(normalized, None)
+        if _entry:
+            self.doc_freq.subtract(_entry[0].keys())
+
+    def _vector(self, terms):
+        total = len(self.entries) + 1
+        vector = {term: count * (math.log(total / (self.doc_freq[term] + 1)) + 1)
+                  for term, count in terms.items()}
+        norm = math.sqrt(sum(value * value for value in vector.values())) or 1.0
+        return {term: value / norm for term, value in vector.items()}
+
+    def nearest(self, normalized):
+        """ Returns (similarity, response) of the closest question """
+        query = self._vector(_terms(normalized))
+        numbers = _numbers(normalized)
+        best = (0.0, None)
+        for question, (terms, response) in self.entries.items():
+            # "top 5" and "top 10" must never share a cached query
+            if _numbers(question) != numbers:
+                continue
+            vector = self._vector(terms)
+            score = sum(value * vector.get(term, 0.0) for term, value in query.items())
+            if score > best[0]:
+                best = (score, response)
+        return best
+
+
+# ddl fingerprint -> question index, kept in LRU order
+_indexes: OrderedDict = OrderedDict()
+
+
+def _redis_key(fingerprint):
+    # v2: normalization keeps logical / grouping words, v1 entries are not reused
+    return f"nl_sql_cache:v2:{fingerprint}"
+
+
+async def _get_index(fingerprint) -> _QuestionIndex:
+    index = _indexes.get(fingerprint)
+    if index is not None:
+        _indexes.move_to_end(fingerprint)
+        return index
+
+    index = _QuestionIndex()
+    try:
+        for normalized, response in (await get_redis().hgetall(_redis_key(fingerprint))).items():
+            index.add(normalized, response)
+    except Exception as e:
+        logger.exception(f"error in loading semantic cache {e}")
+    _indexes[fingerprint] = index
+    while len(_indexes) > MAX_DATASETS:
+        _indexes.popitem(last=False)
+    return index
+
+
+async def lookup_sql(question: str, ddl_text: str) -> str | None:
+    """ Returns a cached nl_sql_agent response for the same or a near identical question """
+    try:
+        normalized = normalize_question(question)
+        if not normalized:
+            return None
+        index = await _get_index(ddl_fingerprint(ddl_text))
+        if normalized in index.entries:
+            logger.info("semantic cache exact hit")
+            return index.entries[normalized][1]
+
+        score, response = index.nearest(normalized)
+        if response is not None and score >= SIMILARITY_THRESHOLD:
+            logger.info(f"semantic cache similarity hit ({score:.3f})")
+            return response
+    except Exception as e:
+        logger.exception(f"error in semantic cache lookup {e}")
+    return None
+
+
+async def store_sql(question: str, ddl_text: str, response: str):
+    """ Caches a generated sql response for a question on a dataset, only call it once the query ran """
+    try:
+        normalized = normalize_question(question)
+        if not normalized:
+            return
+        fingerprint = ddl_fingerprint(ddl_text)
+        index = await _get_index(fingerprint)
+        index.add(normalized, response)
+        _redis = get_redis()
+        await _redis.hset(_redis_key(fingerprint), normalized, response)
+        await _redis.expire(_redis_key(fingerprint), REDIS_TTL)
+    except Exception as e:
+        logger.exception(f"error in semantic cache store {e}")
+
+
+async def forget_sql(question: str, ddl_text: str):
+    """ Drops the cached response of a question, used when its query failed """
+    try:
+        normalized = normalize_question(question)
+        if not normalized:
+            return
+        fingerprint = ddl_fingerprint(ddl_text)
+        (await _get_index(fingerprint)).remove(normalized)
+        await get_redis().hdel(_redis_key(fingerprint), normalized)
+    except Exception as e:
+        logger.exception(f"error in semantic cache delete {e}")
@@ -0,0 +1,126 @@
+import re
+from json import loads, JSONDecodeError
+from src.main_logger import logger
+from library.graph import graph
+from library.budget import Budget, RECURSION_LIMIT
+
+STREAMED_NODES = ("chatbot", "tools", "partial_answer")
+ANSWER_NODES = ("chatbot", "partial_answer")
+FINAL_ANSWER_KEY = re.compile(r'"final_answer"\s*:\s*"')
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class FinalAnswerStreamer:
+    """
+    Incrementally extracts the `final_answer` string value from a streamed
+    ReAct json response, so its tokens can be forwarded as they arrive.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = None
+        self.done = False
+
+    def feed(self, chunk: str) -> str:
+        """ Adds a chunk, returns newly decoded final answer text """
+        self.buffer += chunk
+        if self.done:
+            return ""
+        if self.pos is None:
+            match = FINAL_ANSWER_KEY.search(self.buffer)
+            if not match:
+                return ""
+            self.pos = match.end()
+
+        decoded = []
+        while self.pos < len(self.buffer):
+            char = self.buffer[self.pos]
+            if char == '"':
+                self.done = True
+                break
+            if char != "\\":
+                decoded.append(char)
+                self.pos += 1
+                continue
+            # escape sequence, wait for the complete sequence to arrive
+            if self.pos + 1 >= len(self.buffer):
+                break
+            _escaped = self.buffer[self.pos + 1]
+            if _escaped == "u":
+                if self.pos + 6 > len(self.buffer):
+                    break
+                try:
+                    decoded.append(chr(int(self.buffer[self.pos + 2:self.pos + 6], 16)))
+                except ValueError:
+                    pass
+                self.pos += 6
+            else:
+                decoded.append(_ESCAPES.get(_escaped, _escaped))
+                self.pos += 2
+        return "".join(decoded)
+
+
+def _is_chart(value) -> bool:
+    """ Checks if an extra_context value is a chart config """
+    return isinstance(value, dict) and "series" in value and "chart" in value
+
+
+async def stream_graph(state):
+    """
+    Runs the graph and yields stream events:
+        node_start -> {"node"}
+        tool_start / tool_end -> {"tool"}
+        token -> {"content"} tokens of the final answer
+        chart -> {"ref_key", "config"}
+        result -> {"state"} final graph state (always the last event)
+        error -> {"message"}
+    """
+    streamers = {}
+    sent_charts = set()
+    final_state = None
+    try:
+        state.setdefault("budget", Budget())
+        state.setdefault("pending_sql", {})
+        async for event in graph.astream_events(state, version="v2", config={"recursion_limit": RECURSION_LIMIT}):
+            kind = event["event"]
+            name = event.get("name")
+            node = event.get("metadata", {}).get("langgraph_node")
+
+            if kind == "on_chain_start" and name in STREAMED_NODES and node == name:
+                yield "node_start", {"node": name}
+
+            elif kind == "on_tool_start":
+                yield "tool_start", {"tool": name}
+
+            elif kind == "on_tool_end":
+                yield "tool_end", {"tool": name}
+
+            elif kind == "on_chat_model_stream" and node in ANSWER_NODES:
+                streamer = streamers.setdefault(event["run_id"], FinalAnswerStreamer())
+                _text = streamer.feed(str(event["data"]["chunk"].content))
+                if _text:
+                    yield "token", {"content": _text}
+
+            elif kind == "on_chain_end" and name == "tools" and node == name:
+                _output = event["data"].get("output") or {}
+                for ref_key, value in (_output.get("extra_context") or {}).items():
+                    if ref_key not in sent_charts and _is_chart(value):
+                        sent_charts.add(ref_key)
+                        yield "chart", {"ref_key": ref_key, "config": value}
+
+            elif kind == "on_chain_end" and not event.get("parent_ids"):
+                final_state = event["data"].get("output")
+
+    except Exception as e:
+        logger.exception(f"error in streaming graph {e}")
+        yield "error", {"message": "We are ancountering an issue at our end Please Try again later"}
+
+    yield "result", {"state": final_state}
+
+
+def parse_ws_query(message: str) -> str:
+    """ Extracts user query from a websocket message """
+    try:
+        return loads(message).get("user_query", "")
+    except (JSONDecodeError, AttributeError):
+        return message
@@ -1,36 +1,59 @@
-import multiprocessing
 import re
+import time
 import asyncio
-import traceback
-import sqlite3
 import pandas as pd
 from typing import Any
 from json import dumps, loads
-import numpy as np
-from faker import Faker
 from uuid import uuid4
 import pandas as pd
-from langchain_core.messages import  HumanMessage, SystemMessage
+from langchain_core.messages import  AIMessage, HumanMessage, SystemMessage
 from langchain_core.tools import tool
 from library.utils import (trace_call, extract_json_from_string, get_ddls, format_ddls,
                             get_tabel_mapping, remove_imports)
 from src.main_logger import logger
 from library.prompts import NL_SQL_PROMPT, CODE_GENERATOR_PROMPT, CHART_INPUT_PROMPT
 from library.llm_resp import llm, llm_complex
-from library.resolve_sql import replace_table_names
-
+from library.resolve_sql import resolve_query
+from library.result_store import to_columnar
+from library.chart_data import build_chart_data, pivot_series
+from library.semantic_cache import lookup_sql, store_sql, forget_sql
+from library.result_cache import result_cache_key, get_cached_result, cache_result
+from library.sandbox import get_sandbox_pool
+from library.query_engine import get_query_engine
+from library.metrics import SQL_DURATION, SQL_ROWS
+from src.common import get_config
+
+_answer_config = get_config("answer_data_question") or {}
+
+MAX_SQL_RETRIES = _answer_config.get("max_sql_retries", 2)
+PREVIEW_ROWS = _answer_config.get("preview_rows", 20)
+
+
+def _run_query(sql: str) -> pd.DataFrame:
+    """ Runs a resolved query on the query engine, records duration and row count """
+    engine = get_query_engine()
+    start = time.perf_counter()
+    try:
+        df = engine.run_query(sql)
+    except Exception:
+        SQL_DURATION.labels(engine.name, "error").observe(time.perf_counter() - start)
+        raise
+    SQL_DURATION.labels(engine.name, "ok").observe(time.perf_counter() - start)
+    SQL_ROWS.observe(len(df))
+    return df
 
 
 @tool
 @trace_call
 async def execute_query(query: str) -> dict:
     """
-    Executes a SQL query on a SQLite database and returns the result metadata.
+    Executes a SQL query on the dataset query engine and returns the result metadata.
 
     Parameters:
     - query (str): SQL query to execute.
 
     Returns:
+    - result dataframe (kept by the system, never shown to you)
     - metadata (dict): keys:
         rows-> count of rows in df,
         columns -> column information in df,
@@ -38,31 +61,24 @@ async def execute_query(query: str) -> dict:
     Note: In case of error a error_message key will only be present in the dict
         containing error message
     """
-    def run_query(_sql):
-        try:
-            conn = sqlite3.connect("local_db.sqlite")
-            df = pd.read_sql_query(_sql, conn)
-            conn.close()
-
-            ref_key = str(uuid4())
-            metadata = {
-                "rows": len(df),
-                "columns": list(df.columns),
-                "ref_key": ref_key
-            }
-            df_dict = df.to_dict(orient='list')
-            return df_dict, metadata
-
-        except Exception as e:
-            return {}, {
-                "error_message": f"An error occurred during data fetching: {e}"
-            }
     _args = loads(query)
     _query = _args.get("query")
     tabel_mapping = _args.get("tabel_mapping",{})
-    resolved_sql = replace_table_names(_query, tabel_mapping)
+    resolved_sql, tables, canonical_sql = resolve_query(_query, tabel_mapping)
     logger.info(f"sql query after resolution {resolved_sql}")
-    return await asyncio.to_thread(run_query, resolved_sql)
+    try:
+        cache_key = result_cache_key(tables, canonical_sql)
+        df = await get_cached_result(cache_key)
+        if df is None:
+            df = await asyncio.to_thread(_run_query, resolved_sql)
+            await cache_result(cache_key, df, tables)
+        else:
+            logger.info("query result served from result cache")
+        return df, {"rows": len(df), "columns": list(df.columns)}
+    except Exception as e:
+        return {}, {
+            "error_message": f"An error occurred during data fetching: {e}"
+        }
 
 
 @tool
@@ -76,10 +92,13 @@ async def nl_sql_agent(question: str) -> str:
         _params = loads(question)
         _ques = _params.get("question","")
         session_id = _params.get("session_id")
-        ddls = await asyncio.to_thread(get_ddls, session_id)
+        ddls = await get_ddls(session_id)
         tabel_text = format_ddls(ddls)
         logger.info(f"Args: {question=}")
-        logger.info(f"tabel DDLS ---\n {tabel_text}\n-----------")
+        logger.debug(f"tabel DDLS ---\n {tabel_text}\n-----------")
+        cached_sql = await lookup_sql(_ques, tabel_text)
+        if cached_sql:
+            return cached_sql
         _prompt = NL_SQL_PROMPT.format(ddls=tabel_text)
         messages = [
             SystemMessage(content=_prompt),
@@ -87,7 +106,7 @@ async def nl_sql_agent(question: str) -> str:
         ]
 
         llm_resp = await llm_complex.ainvoke(messages)
-        logger.info(f"nl_sql_agent Response: {llm_resp}")
+        logger.debug(f"nl_sql_agent Response: {llm_resp.content}")
 
         def extract_sql():
             think_match = re.search(r"<think>(.*?)</think>", llm_resp.content, re.DOTALL)
@@ -97,6 +116,7 @@ async def nl_sql_agent(question: str) -> str:
 
         cleaned_string = await asyncio.to_thread(extract_sql)
 
+        # cached by the caller (record_sql_outcome) once the query ran
         logger.info(f"-----------SQL generated: \n{cleaned_string} -------------")
         return cleaned_string
 
@@ -104,41 +124,153 @@ async def nl_sql_agent(question: str) -> str:
         logger.exception(e)
         return "Could not generate sql query"
 
+
+async def record_sql_outcome(question: str, session_id, response: str, succeeded: bool):
+    """ Caches a nl_sql_agent response whose query ran, drops it from the cache when the query failed """
+    ddl_text = format_ddls(await get_ddls(session_id))
+    if succeeded:
+        await store_sql(question, ddl_text, response)
+    else:
+        await forget_sql(question, ddl_text)
+
+
+def extract_sql_query(response: str) -> str:
+    """ Returns the query of a single <sql> tag response, empty string otherwise """
+    query_list = re.findall(r"<sql>(.*?)</sql>", response, re.DOTALL)
+    if len(query_list) == 1 and query_list[0].strip():
+        return query_list[0].strip()
+    return ""
+
+
+@tool
+@trace_call
+async def answer_data_question(question: str) -> tuple:
+    """
+    Answers a natural language question on the dataset in one step:
+    generates the sql, runs it and returns a preview of the result.
+    Failed queries are regenerated with the sql error (up to MAX_SQL_RETRIES times).
+
+    Returns:
+    - result dataframe (kept by the system, never shown to you)
+    - metadata (dict): keys:
+        sql -> executed query,
+        rows -> count of rows in df,
+        columns -> column information in df,
+        preview -> first PREVIEW_ROWS rows of the result
+    Note: In case of error a error_message key will be present in the dict
+    """
+    _params = loads(question)
+    _ques = _params.get("question", "")
+    session_id = _params.get("session_id")
+
+    response = await nl_sql_agent.ainvoke(question)
+    query = extract_sql_query(response)
+    if not query:
+        # clarification request or generation failure, pass it on as is
+        return {}, {"error_message": re.sub(r"</?text>", "", response).strip()}
+
+    _tabel_mapping = await get_tabel_mapping(session_id)
+    messages = None
+    for attempt in range(MAX_SQL_RETRIES + 1):
+        df, metadata = await execute_query.ainvoke(dumps({"query": query, "tabel_mapping": _tabel_mapping}))
+        if "error_message" not in metadata:
+            await record_sql_outcome(_ques, session_id, response, True)
+            metadata["sql"] = query
+            metadata["preview"] = loads(df.head(PREVIEW_ROWS).to_json(orient="records", date_format="iso"))
+            return df, metadata
+        if attempt == MAX_SQL_RETRIES:
+            break
+
+        logger.info(f"retrying sql generation .... {metadata['error_message']}")
+        if messages is None:
+            messages = [
+                SystemMessage(content=NL_SQL_PROMPT.format(ddls=format_ddls(await get_ddls(session_id)))),
+                HumanMessage(content=_ques)
+            ]
+        messages += [
+            AIMessage(content=response),
+            HumanMessage(content=f"The query failed with below error:\n{metadata['error_message']}\n\n"
+                                 "Please fix it and return the corrected query in <sql> tags and nothing else")
+        ]
+        llm_resp = await llm_complex.ainvoke(messages)
+        response = re.sub(r"<think>.*?</think>", "", llm_resp.content, flags=re.DOTALL).strip()
+        _fixed_query = extract_sql_query(response)
+        if not _fixed_query:
+            break
+        query = _fixed_query
+
+    await record_sql_outcome(_ques, session_id, response, False)
+    metadata["sql"] = query
+    return {}, metadata
+
+
 @tool
 @trace_call
-async def generate_highchart_config(ref_key: str|Any, x: str, y: str, chart_type: str, chart_title: str) -> str:
+async def generate_highchart_config(ref_key: str|Any, x: str, y: str|list[str], chart_type: str, chart_title: str,
+                                    series_by: str|None = None, separate_axes: bool = False) -> str:
     """
     Creates a high chart config
     Input:
         ref_key: the output key to refrence data (uuid4 you get by execute query tool)
         x: Column to be used in x axis of chart (should match actual column name in data)
-        y: Column to be used in y axis of chart (should match actual column name in data)
+        y: Column or list of columns to be used in y axis of chart, every column becomes a series
+            (should match actual column names in data)
         chart_type: chart type to display (e.g. bar, column, line, area, pie etc)
         chart_title: chart title to be displayed on the chart
+        series_by: optional column whose values split the data into one series per value
+            (e.g. x="month", y="sales", series_by="region" gives one line per region)
+        separate_axes: give every y column its own y axis (use when y columns have different units/scales)
     Returns:
         uuid4 string which can be given to user as output
     """
     def _generate():
         try:
-            if not isinstance(ref_key.get(x), list) or not isinstance(ref_key.get(y), list):
-                raise ValueError("Unable to access column data")
-            if len(ref_key[x]) != len(ref_key[y]):
-                raise ValueError("x and y columns must be of the same length")
-
+            y_columns = [y] if isinstance(y, str) else list(y)
             _columns = list(ref_key.keys())
             logger.info(_columns)
 
             chart_type_local = chart_type or "line"
             chart_title_local = chart_title or "Chart Generated"
 
-            if x not in _columns or y not in _columns:
+            if not y_columns or any(column not in _columns for column in [x, *y_columns]):
                 raise ValueError("Specified x or y column does not exist in the input data")
+            if series_by and series_by not in _columns:
+                raise ValueError("Specified series_by column does not exist in the input data")
+            if any(len(ref_key[column]) != len(ref_key[x]) for column in y_columns):
+                raise ValueError("x and y columns must be of the same length")
 
             logger.info(f"{chart_title_local=}")
-            logger.info(f"{x=} {y=} {chart_type_local=}")
+            logger.info(f"{x=} {y_columns=} {series_by=} {chart_type_local=}")
 
-            data = [{"x": i, "y": float(val)} for i, val in enumerate(ref_key[y])]
-            categories = [str(val) for val in ref_key[x]]
+            x_values, series, series_columns = pivot_series(ref_key, x, y_columns, series_by)
+            chart_data = build_chart_data(x_values, series, chart_type_local)
+            categories = chart_data["categories"]
+            if categories is not None:
+                x_axis = {
+                    "categories": categories,
+                    "max": 9 if len(categories) > 10 else None,
+                    "scrollbar": {"enabled": True},
+                    "title": {"text": x},
+                    "min": 0
+                }
+            else:
+                x_axis = {"type": chart_data["x_type"], "title": {"text": x}}
+            show_markers = max(len(_series["data"]) for _series in chart_data["series"]) <= 100
+
+            if separate_axes and len(y_columns) > 1:
+                y_axis = [
+                    {"title": {"text": column}, "opposite": i % 2 == 1}
+                    for i, column in enumerate(y_columns)
+                ]
+                for _series in chart_data["series"]:
+                    _series["yAxis"] = y_columns.index(series_columns[_series["name"]])
+            else:
+                y_axis = {
+                    "title": {"text": y_columns[0] if len(y_columns) == 1 else ""},
+                    "scrollbar": {"enabled": True}
+                }
+            for _series in chart_data["series"]:
+                _series["marker"] = {"enabled": show_markers}
 
             config = {
                 "chart": {
@@ -152,32 +284,18 @@ async def generate_highchart_config(ref_key: str|Any, x: str, y: str, chart_type
                     # }
                 },
                 "title": {"text": chart_title_local},
-                "xAxis": {
-                    "categories": categories,
-                    "max": 9 if len(categories) > 10 else None,
-                    "scrollbar": {"enabled": len(categories) > 10},
-                    "scrollbar": {"enabled": True},
-                    "title": {"text": x},
-                    "min": 0
-                },
-                "yAxis": {
-                    "title": {"text": y},
-                    "scrollbar": {"enabled": True}
-                },
+                "xAxis": x_axis,
+                "yAxis": y_axis,
                 "legend": {"enabled": True},
                 "tooltip": {
                     "shared": True,
                     "crosshairs": True,
                     "valueDecimals": 2
                 },
-                "series": [{
-                    "name": y,
-                    "data": data,
-                    "marker": {"enabled": True}
-                }],
+                "series": chart_data["series"],
                 "plotOptions": {
                     chart_type_local: {
-                        "marker": {"enabled": True},
+                        "marker": {"enabled": show_markers},
                         "dataLabels": {"enabled": False}
                     }
                 },
@@ -204,82 +322,31 @@ async def generate_highchart_config(ref_key: str|Any, x: str, y: str, chart_type
     return await asyncio.to_thread(_generate)
 
 
-def _execute_code(code, variables_to_return, return_dict):
-    try:
-        fake = Faker()
-        allowed_globals = {
-            "__builtins__":{
-            # Basic types and constructors
-            "range": range,
-            "len": len,
-            "str": str,
-            "int": int,
-            "float": float,
-            "bool": bool,
-            "list": list,
-            "dict": dict,
-            "set": set,
-            "tuple": tuple,
-
-            # Iteration and functional programming
-            "enumerate": enumerate,
-            "zip": zip,
-            "map": map,
-            "filter": filter,
-            "sorted": sorted,
-            "any": any,
-            "all": all,
-
-            # Numeric utilities
-            "sum": sum,
-            "min": min,
-            "max": max,
-            "abs": abs,
-            "round": round,
-            "pow": pow,
-
-            # String utilities
-            "format": format,
-            "chr": chr,
-            "ord": ord,
-        },
-            "pd": pd,
-            "np": np,
-            "faker": fake,
-            "Faker": Faker,
-        }
-
-        local_vars = {}
-        exec(code, allowed_globals, local_vars)
-        if variables_to_return:
-            output = {var: local_vars.get(var, None) for var in variables_to_return}
-        else:
-            output = local_vars
-        return_dict["result"] = output
-
-    except Exception:
-        return_dict["error"] = traceback.format_exc()
-
-
 def run_code(code: str, variables_to_return: list = None, timeout: int = 7):
+    """ Runs generated code on a warm sandbox worker """
+    return get_sandbox_pool().run(code, variables_to_return, timeout)
 
-    manager = multiprocessing.Manager()
-    return_dict = manager.dict()
 
-    p = multiprocessing.Process(target=_execute_code, args=(code, variables_to_return, return_dict))
-    p.start()
-    p.join(timeout)
+async def arun_code(code: str, variables_to_return: list = None, timeout: int = 7):
+    """ Runs generated code on a warm sandbox worker without blocking the event loop """
+    return await get_sandbox_pool().arun(code, variables_to_return, timeout)
 
-    if p.is_alive():
-        p.terminate()
-        return {"error": f"Code execution exceeded {timeout} seconds."}
 
-    return dict(return_dict)
+def _parse_generated_code(content: str):
+    """ Extracts code and dataset json from code generator response """
+    code_match = re.search(r"<code>(.*?)</code>", content, re.DOTALL)
+    json_match = re.search(r"<json>(.*?)</json>", content, re.DOTALL)
+    code = code_match.group(1).strip() if code_match else ""
+    _json_candidate = json_match.group(1).strip() if json_match else ""
+    logger.debug(f"code--\n{code}\njson-\n{_json_candidate}")
+    json_resp = extract_json_from_string(_json_candidate)
+    logger.debug(f"----------------\n{json_resp}\n-------------------")
+    return remove_imports(code), json_resp
 
 
 @tool
 @trace_call
-def generate_dataset(user_request:str) -> str:
+async def generate_dataset(user_request:str) -> str:
     """
     Generates a Synthetic Dataset
     Input: takes a user request to create  a Dataset
@@ -291,44 +358,20 @@ def generate_dataset(user_request:str) -> str:
             HumanMessage(content=user_request)
         ]
 
-        llm_resp = llm_complex.invoke(messages)
-        think_content_match = re.search(r"<think>(.*?)</think>", llm_resp.content, re.DOTALL)
-        code_match = re.search(r"<code>(.*?)</code>", llm_resp.content, re.DOTALL)
-        json_match = re.search(r"<json>(.*?)</json>", llm_resp.content, re.DOTALL)
-        think_content = think_content_match.group(1).strip() if think_content_match else ""
-        cleaned_string = re.sub(r"<think>.*?</think>", "", llm_resp.content, flags=re.DOTALL)
-        code = code_match.group(1).strip() if code_match else ""
-        _json_candidate = json_match.group(1).strip() if json_match else ""
-        logger.info(f"code--\n{code}\njson-\n{_json_candidate}")
-        json_resp = extract_json_from_string(_json_candidate)
-        logger.info(f"----------------\n{json_resp}\n-------------------")
+        llm_resp = await llm_complex.ainvoke(messages)
+        code, json_resp = _parse_generated_code(llm_resp.content)
         vars = json_resp.pop("vars",[])
         logger.info(f"variables to acess --> {vars}")
-        code = remove_imports(code)
-        result = run_code(code, vars)
-        print("*"*40)
-        print(result)
-        print("*"*40)
+        result = await arun_code(code, vars)
         result["dataset_info"] = json_resp
         if "error" in result:
-            logger.info("retring ....")
+            logger.info(f"retring .... {result['error']}")
             messages.append(HumanMessage(f"from your given code i ancountered below error:\n{result.get('error','')}\n\nPlease fix it and regenerate complete json object and nothing else"))
-            _fixed_error = llm_complex.invoke(messages)
-            think_content = think_content_match.group(1).strip() if think_content_match else ""
-            cleaned_string = re.sub(r"<think>.*?</think>", "", _fixed_error.content, flags=re.DOTALL)
-            code_match = re.search(r"<code>(.*?)</code>", _fixed_error.content, re.DOTALL)
-            json_match = re.search(r"<json>(.*?)</json>", _fixed_error.content, re.DOTALL)
-            _code = code_match.group(1).strip() if code_match else ""
-            _json_candidate = json_match.group(1).strip() if json_match else ""
-            logger.info(cleaned_string)
-            _fixed_error = extract_json_from_string(_json_candidate)
-            _code = remove_imports(_code)
+            _fixed_error = await llm_complex.ainvoke(messages)
+            _code, _fixed_error = _parse_generated_code(_fixed_error.content)
             _vars = _fixed_error.pop("vars",[])
-            result = run_code(_code, _vars)
-            logger.info(f"output after fix")
-            print("*"*40)
-            print(result)
-            print("*"*40)
+            result = await arun_code(_code, _vars)
+            logger.info(f"output after fix {list(result)}")
             result["dataset_info"] = _fixed_error
         return result
     except Exception  as e:
@@ -346,25 +389,21 @@ async def nlp_to_chart(question:str, chart_type:str|None)->str:
     try:
         _input = loads(question)
         session_id = _input.get("session_id")
-        sql_pattern = r"<sql>(.*?)</sql>"
-        query = ""
         logger.info(f"calling nlp to sql agent ")
         response = await nl_sql_agent.ainvoke(question)
-        query_list = re.findall(sql_pattern, response, re.DOTALL)
-        if len(query_list) == 1 and query_list[0].strip():
-            query = query_list[0]
-        else:
+        query = extract_sql_query(response)
+        if not query:
             return response
-        _tabel_mapping = get_tabel_mapping(session_id)
+        _tabel_mapping = await get_tabel_mapping(session_id)
         _query_args = {
             "query":query,
             "tabel_mapping":_tabel_mapping
         }
         _query_args = dumps(_query_args)
         data, metadata = await execute_query.ainvoke(_query_args)
+        await record_sql_outcome(_input.get("question", ""), session_id, response, "error_message" not in metadata)
         if "error_message" in metadata:
             return metadata["error_message"]
-        metadata.pop("ref_key",None)
         _chart_prompt = [
             SystemMessage(content=CHART_INPUT_PROMPT),
             HumanMessage(content=dumps(metadata))
@@ -372,8 +411,9 @@ async def nlp_to_chart(question:str, chart_type:str|None)->str:
         resp = await llm_complex.ainvoke(_chart_prompt)
         logger.info(f"chart input response {resp.content}")
         charting_input = extract_json_from_string(resp.content)
-        charting_input["ref_key"] = data
-        charting_input["chart_type"] = chart_type
+        charting_input["ref_key"] = to_columnar(data)
+        # chart_type is only set when the user asked for one, else keep the suggested type
+        charting_input["chart_type"] = chart_type or charting_input.get("chart_type") or "column"
         chart_ref_key, chart_config = await generate_highchart_config.ainvoke(charting_input)
         return {"ref_key": chart_ref_key, "chart_config": chart_config, "error":False}
     except Exception as e:
@@ -382,7 +422,7 @@ async def nlp_to_chart(question:str, chart_type:str|None)->str:
 
 def get_llm_with_tools():
     """Returns llm with tools"""
-    tools = [nl_sql_agent, execute_query, generate_highchart_config, generate_dataset, nlp_to_chart]
+    tools = [nl_sql_agent, execute_query, answer_data_question, generate_highchart_config, generate_dataset, nlp_to_chart]
     llm_with_tools = llm.bind_tools(tools=tools, tool_choice="auto")
     return llm_with_tools
 
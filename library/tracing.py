@@ -0,0 +1,202 @@
+import os
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from json import dumps
+from urllib import request as urllib_request
+from uuid import uuid4
+from src.common import get_config
+from src.main_logger import logger
+
+_tracing_config = get_config("tracing") or {}
+
+ENABLED = _tracing_config.get("enabled", True)
+MAX_TRACES = _tracing_config.get("max_traces", 500)
+MAX_SPANS_PER_TRACE = _tracing_config.get("max_spans_per_trace", 500)
+JSONL_PATH = _tracing_config.get("jsonl_path", None)
+OTLP_ENDPOINT = _tracing_config.get("otlp_endpoint", None)
+OTLP_FLUSH_SECONDS = _tracing_config.get("otlp_flush_seconds", 5)
+SERVICE_NAME = _tracing_config.get("service_name", "chatbot-backend")
+
+# (trace id, span id) of the active span, None outside of a traced request
+_current: ContextVar = ContextVar("current_span", default=None)
+
+# trace id -> finished spans, kept in insertion order as a ring buffer
+_traces: OrderedDict = OrderedDict()
+_traces_lock = threading.Lock()
+
+
+def new_trace_id() -> str:
+    """ 32 hex chars, usable as an OTLP trace id """
+    return uuid4().hex
+
+
+def current_trace_id() -> str | None:
+    _span = _current.get()
+    return _span[0] if _span else None
+
+
+def _record(span: dict):
+    with _traces_lock:
+        spans = _traces.get(span["trace_id"])
+        if spans is None:
+            spans = _traces[span["trace_id"]] = []
+            while len(_traces) > MAX_TRACES:
+                _traces.popitem(last=False)
+        if len(spans) < MAX_SPANS_PER_TRACE:
+            spans.append(span)
+    if _writer:
+        _writer.put(span)
+    if _exporter:
+        _exporter.put(span)
+
+
+@contextmanager
+def span(name: str, trace_id: str | None = None, **attributes):
+    """
+    Times a block as a span of the current trace, a no-op outside of a trace
+    unless trace_id is given (root span of a new trace)
+    Yields the attributes dict so callers can add attributes while the span is open
+    """
+    parent = _current.get()
+    if not ENABLED or (parent is None and trace_id is None):
+        yield attributes
+        return
+
+    trace_id = trace_id or parent[0]
+    span_id = uuid4().hex[:16]
+    token = _current.set((trace_id, span_id))
+    start_ns = time.time_ns()
+    start = time.perf_counter()
+    status = "error"
+    try:
+        yield attributes
+        status = "ok"
+    finally:
+        _current.reset(token)
+        _record({
+            "trace_id": trace_id,
+            "span_id": span_id,
+            "parent_id": parent[1] if parent and parent[0] == trace_id else None,
+            "name": name,
+            "start_ns": start_ns,
+            "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+            "status": status,
+            "attributes": attributes
+        })
+
+
+def get_trace(trace_id: str) -> list | None:
+    """ Spans of a trace from the ring buffer, ordered by start time """
+    with _traces_lock:
+        spans = _traces.get(trace_id)
+        spans = list(spans) if spans is not None else None
+    if spans is None:
+        return None
+    return sorted(spans, key=lambda _span: _span["start_ns"])
+
+
+class _BackgroundSink(ABC):
+    """ Hands spans to a daemon thread so file / network io stays off the event loop """
+
+    def __init__(self, name):
+        self._queue = queue.Queue(maxsize=10_000)
+        threading.Thread(target=self._run, name=name, daemon=True).start()
+
+    def put(self, span: dict):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            pass
+
+    def _drain(self, timeout):
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=timeout))
+            while len(batch) < 512:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    @abstractmethod
+    def _run(self):
+        """ Thread body, drains the queue and writes / exports the spans """
+
+
+class _JsonlWriter(_BackgroundSink):
+    """ Appends finished spans to a JSONL file """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        super().__init__("trace-jsonl-writer")
+
+    def _run(self):
+        while True:
+            batch = self._drain(timeout=None)
+            try:
+                with open(self.path, "a") as f:
+                    f.writelines(dumps(_span, default=str) + "\n" for _span in batch)
+            except OSError as e:
+                logger.info(f"unable to write traces {e}")
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(spans: list) -> dict:
+    """ OTLP/HTTP json payload of finished spans """
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{
+            "scope": {"name": "library.tracing"},
+            "spans": [{
+                "traceId": _span["trace_id"],
+                "spanId": _span["span_id"],
+                "parentSpanId": _span["parent_id"] or "",
+                "name": _span["name"],
+                "kind": 1,
+                "startTimeUnixNano": str(_span["start_ns"]),
+                "endTimeUnixNano": str(_span["start_ns"] + int(_span["duration_ms"] * 1_000_000)),
+                "attributes": [{"key": key, "value": _otlp_value(value)}
+                               for key, value in _span["attributes"].items()],
+                "status": {"code": 1 if _span["status"] == "ok" else 2}
+            } for _span in spans]
+        }]
+    }]}
+
+
+class _OTLPExporter(_BackgroundSink):
+    """ Posts batches of spans to an OTLP/HTTP collector (json encoding) """
+
+    def __init__(self, endpoint):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        super().__init__("trace-otlp-exporter")
+
+    def _run(self):
+        while True:
+            batch = self._drain(timeout=None)
+            time.sleep(OTLP_FLUSH_SECONDS)
+            batch += self._drain(timeout=0)
+            try:
+                _request = urllib_request.Request(self.url, data=dumps(to_otlp(batch), default=str).encode(),
+                                                  headers={"Content-Type": "application/json"})
+                urllib_request.urlopen(_request, timeout=10).close()
+            except Exception as e:
+                logger.info(f"unable to export {len(batch)} spans {e}")
+
+
+_writer = _JsonlWriter(JSONL_PATH) if ENABLED and JSONL_PATH else None
+_exporter = _OTLPExporter(OTLP_ENDPOINT) if ENABLED and OTLP_ENDPOINT else None
@@ -1,29 +1,41 @@
 import functools
 import re
-from ast import literal_eval
 import time
 from datetime import datetime
-import sqlite3
 import asyncio
 from json import dumps
 import pandas as pd
-from json import loads
 from uuid import uuid4
-from library.db_connect import session_scope
+from sqlalchemy import update
+from library.db_connect import async_session_scope
 from library.models import Dataset, ChatThread
+from library.query_engine import get_query_engine
+from library.result_cache import invalidate_tables
+from library.metadata_cache import get_session_metadata, invalidate_session_metadata
+from library.metrics import NODE_DURATION
+from library.tracing import span
+from library.react_parser import parse_json_object
 from src.main_logger import logger
 
 def trace_call(func):
-    """ Traces function Entry Exit and Time, supports sync and async funcs """
+    """
+    Traces function Entry Exit and Time, supports sync and async funcs,
+    durations go to NODE_DURATION and a span of the current request trace
+    """
 
     if asyncio.iscoroutinefunction(func):
         @functools.wraps(func)
         async def async_wrapper(*args, **kwargs):
             logger.info(f"====================== 🔷 Entering: {func.__name__} Node =====================")
-            start_time = time.time()
-            result = await func(*args, **kwargs)
-            end_time = time.time()
-            duration = end_time - start_time
+            start_time = time.perf_counter()
+            status = "error"
+            try:
+                with span(func.__name__):
+                    result = await func(*args, **kwargs)
+                status = "ok"
+            finally:
+                duration = time.perf_counter() - start_time
+                NODE_DURATION.labels(func.__name__, status).observe(duration)
             logger.info(f"=============== ✅ Exiting: {func.__name__} (Execution time: {duration:.4f} seconds)======")
             return result
         return async_wrapper
@@ -31,10 +43,15 @@ def trace_call(func):
         @functools.wraps(func)
         def sync_wrapper(*args, **kwargs):
             logger.info(f"====================== 🔷 Entering: {func.__name__} Node =====================")
-            start_time = time.time()
-            result = func(*args, **kwargs)
-            end_time = time.time()
-            duration = end_time - start_time
+            start_time = time.perf_counter()
+            status = "error"
+            try:
+                with span(func.__name__):
+                    result = func(*args, **kwargs)
+                status = "ok"
+            finally:
+                duration = time.perf_counter() - start_time
+                NODE_DURATION.labels(func.__name__, status).observe(duration)
             logger.info(f"=============== ✅ Exiting: {func.__name__} (Execution time: {duration:.4f} seconds)======")
             return result
         return sync_wrapper
@@ -43,27 +60,16 @@ def trace_call(func):
 
 def extract_json_from_string(s: str):
     """
-    Extracts the first valid JSON object from a string.
+    Extracts the first valid JSON object from a string, tolerates the usual
+    llm defects (see library.react_parser).
 
     Returns:
-        The parsed JSON object (as dict or list), or None if not found.
+        The parsed JSON object, or {} if not found.
     """
-    output = {}
-    try:
-        start = 0
-        end = len(s)-1
-        while(start<end):
-            if s[start] == "{":
-                break
-            start +=1
-        while(end>start):
-            if s[end] == "}":
-                break
-            end -=1
-        output = loads(s[start:end+1])
-    except Exception as e:
-        logger.exception(f'error while extracting json {e}')
-        output = literal_eval(s[start:end+1])
+    output = parse_json_object(s)
+    if output is None:
+        logger.info(f"no json object found in string of {len(s or '')} chars")
+        return {}
     return output
 
 
@@ -71,14 +77,7 @@ def extract_json_from_string(s: str):
 def get_table_ddl(actual_table, table_alias):
     """Gets the table ddl from db"""
     try:
-        conn = sqlite3.connect("local_db.sqlite")
-        cursor = conn.cursor()
-
-        cursor.execute(f"SELECT sql FROM sqlite_master WHERE type='table' AND name=?;", (actual_table,))
-        ddl = cursor.fetchone()
-
-        conn.close()
-        _ddl = ddl[0] if ddl else None
+        _ddl = get_query_engine().get_table_ddl(actual_table)
         if _ddl:
             _ddl = _ddl.replace(actual_table, table_alias)
             logger.info(f"ddl after replacing tabel name with aliasing \n{_ddl}")
@@ -87,7 +86,7 @@ def get_table_ddl(actual_table, table_alias):
         logger.exception(f"error in getting DDL {e}")
 
 
-def save_dataset_info(ddls, metadata, tabel_mapping, session_id):
+async def save_dataset_info(ddls, metadata, tabel_mapping, session_id):
     _result = ""
     try:
         dataset_metadata = {
@@ -101,57 +100,64 @@ def save_dataset_info(ddls, metadata, tabel_mapping, session_id):
             created_by = session_id
         )
 
-        with session_scope() as session:
+        async with async_session_scope() as session:
             session.add(new_dataset)
-            session.commit()
-            session.refresh(new_dataset)
-            _dataset_id = new_dataset.dataset_id
-            chat_thread = session.query(ChatThread).filter(
-                ChatThread.session_uuid == session_id,
-                ChatThread.is_active == True
-            ).first()
-            chat_thread.dataset_id = _dataset_id
-            session.commit()
-
-            msg = {
-                "table_ddls":ddls,
-                "dataset_info": metadata,
-                "status":"Created sucessfully",
-                "hint":"kindly give detailed info to user about dataset in points"
-            }
-            _result = dumps(msg)
+            await session.flush()
+            await session.execute(
+                update(ChatThread).where(
+                    ChatThread.session_uuid == session_id,
+                    ChatThread.is_active == True
+                ).values(dataset_id=new_dataset.dataset_id)
+            )
+            await session.commit()
+        await invalidate_session_metadata(session_id)
+
+        msg = {
+            "table_ddls":ddls,
+            "dataset_info": metadata,
+            "status":"Created sucessfully",
+            "hint":"kindly give detailed info to user about dataset in points"
+        }
+        _result = dumps(msg)
     except Exception as e:
         logger.exception(f"error in saving ddls to firebase: {e}")
         _result = "unable to update dataset info in db"
     return _result
 
-def load_data_to_db(data, metadata, session_id):
-    """Dums df to sql lite tables"""
+def _dump_tables(data):
+    """Writes dataframes to new tables of the query engine, returns ddls and tabel mapping"""
     tabel_ddls = {}
     tabel_mapping = {}
+    engine = get_query_engine()
+    for tabel_name, df in data.items():
+        __table = str(uuid4()).replace('-', '_')
+        engine.load_table(__table, df)
+        logger.info(f"Data dumped in table {__table} for {tabel_name}")
+        tabel_ddl = get_table_ddl(__table, tabel_name)
+        tabel_ddls[tabel_name] = tabel_ddl
+        tabel_mapping[tabel_name.lower()] = __table
+    return tabel_ddls, tabel_mapping
+
+async def load_data_to_db(data, metadata, session_id):
+    """Dums df to sql lite tables"""
     msg = ""
     try:
-        conn = sqlite3.connect("local_db.sqlite")
-        for tabel_name, df in data.items():
-            __table = str(uuid4()).replace('-', '_')
-            df.to_sql(__table, conn, index=False, if_exists="fail")
-            logger.info(f"Data dumped in table {__table} for {tabel_name}")
-            tabel_ddl = get_table_ddl(__table, tabel_name)
-            tabel_ddls[tabel_name] = tabel_ddl
-            tabel_mapping[tabel_name.lower()] = __table
+        tabel_ddls, tabel_mapping = await asyncio.to_thread(_dump_tables, data)
+        await invalidate_tables(tabel_mapping.values())
         logger.info("Data load completed sucessfully")
-        msg =  save_dataset_info(tabel_ddls, metadata, tabel_mapping, session_id)
+        msg = await save_dataset_info(tabel_ddls, metadata, tabel_mapping, session_id)
     except Exception as e:
         logger.exception(f"error in loading data to db {e}")
         msg = f"error in loading data to db {e}\npolitely inform this to user and also ask him to create dataset by uploading excel or try again in some time"
-    finally:
-        conn.close()
     return msg
 
-def create_observation(msg):
-    """doc str"""
+def create_observation(msg, action=None):
+    """Wraps a tool result as an observation, action names the tool when several ran in one step"""
     try:
-        msg = dumps({"Observation":msg})
+        _observation = {"Observation":msg}
+        if action:
+            _observation["action"] = action
+        msg = dumps(_observation, default=str)
     except Exception as e:
         logger.exception(f"error in creating thought response {e}")
     return msg
@@ -196,44 +202,22 @@ def format_ddls(ddls: dict) -> str:
     return resut
 
 
-def get_ddls(session_id):
+async def get_ddls(session_id):
     """Fetch DDLS"""
     ddls = {}
     try:
-        from sqlalchemy.dialects import mysql
-        with session_scope() as session:
-            _metadata = session.query(
-                Dataset.dataset_metadata
-            ).join(
-                ChatThread, Dataset.dataset_id == ChatThread.dataset_id
-            ).filter(
-                ChatThread.session_uuid == session_id
-            ).scalar()
-
-        logger.info("*"*20)
-        logger.info(f"dataset_metadata {_metadata}")
-        logger.info("*"*20)
-
-        if _metadata:
-            ddls = _metadata.get("ddls",{})
+        _metadata = await get_session_metadata(session_id)
+        ddls = _metadata.get("ddls", {})
     except Exception as e:
         logger.exception(f"error in fetching ddls {e}")
     return ddls
 
-def get_tabel_mapping(session_id):
+async def get_tabel_mapping(session_id):
     """Fetch tabel mapping"""
     mapping = {}
     try:
-        with session_scope() as session:
-            _metadata = session.query(
-                Dataset.dataset_metadata
-            ).join(
-                ChatThread, Dataset.dataset_id == ChatThread.dataset_id
-            ).filter(
-                ChatThread.session_uuid == session_id
-            ).scalar()
-        if _metadata:
-            mapping = _metadata.get("tabel_mapping", {})
+        _metadata = await get_session_metadata(session_id)
+        mapping = _metadata.get("tabel_mapping", {})
     except Exception as e:
         logger.exception(f"error in fetching ddls {e}")
     return mapping
@@ -1,32 +1,42 @@
 from fastapi import APIRouter, Request, BackgroundTasks
+from fastapi.responses import JSONResponse
 from datetime import datetime
-import asyncio
 import re
-from json import loads, dumps
-from langchain_core.messages.utils import messages_from_dict
+from copy import deepcopy
+from json import dumps
 from src.main_logger import logger
-from library.cache_connect import get_redis
-from library.db_connect import session_scope
+from library.cache_connect import get_binary_redis, batch, NOT_FETCHED
+from library.db_connect import async_session_scope
 from library.models import ChatThread, ChatMessage
 from library.prompts import MASTER_SYSTEM_PROMOPT, ONE_SHOT, NO_DATASET
 from src.data_models import QueryPayload
 from library.graph import run_graph
-from library.utils import resolve_tags
+from library.utils import resolve_tags, trace_call
+from library.context_memory import compact_context
+from library.context_codec import get_context_codec, decode_context
+from library.metadata_cache import get_session_metadata, invalidate_session_metadata, prefetch_commands
+from library.jobs import get_job
+from library.result_store import ResultStore
+from library.budget import Budget
+from library.react_parser import parse_message
 
 router = APIRouter()
 
+ERROR_RESPONSE = {
+    "msg":[
+        {
+            "content":"We are encountering an issue at aur end Please try again later",
+            "type":"text"
 
-def add_chat_thread(session_id):
+        }
+    ],
+    "role":"AI"
+}
+
+
+async def add_chat_thread(session_id):
     """New Chat Thread"""
     try:
-        thread_id = None
-        new_thread = ChatThread(session_uuid=session_id, title=session_id)
-        with session_scope() as session:
-            session.add(new_thread)
-            session.commit()
-            session.refresh(new_thread)
-            thread_id = new_thread.thread_id
-
         _message = {
                 "msg":[
                     {
@@ -36,33 +46,27 @@ def add_chat_thread(session_id):
                 ],
                 "role":"AI"
             }
-        msg_obj = ChatMessage(
-            thread_id = thread_id,
-            content = dumps(_message),
-            role= "system"
-        )
-        with session_scope() as session:
-            session.add(msg_obj)
-            session.commit()
+        async with async_session_scope() as session:
+            new_thread = ChatThread(session_uuid=session_id, title=session_id)
+            session.add(new_thread)
+            await session.flush()
+            session.add(ChatMessage(
+                thread_id = new_thread.thread_id,
+                content = dumps(_message),
+                role= "system"
+            ))
+            await session.commit()
         return _message
     except Exception as e:
         logger.exception(f"error in adding session in firestore {e}")
 
 
+@trace_call
 def create_response(last_msg, extra_context):
     """ Creates a Response """
-    resp = {
-        "msg":[
-            {
-                "content":"We are encountering an issue at aur end Please try again later",
-                "type":"text"
-
-            }
-        ],
-        "role":"AI"
-    }
+    resp = deepcopy(ERROR_RESPONSE)
     try:
-        __msg_content = loads(last_msg.content).get("final_answer","Unknown error occured")
+        __msg_content = (parse_message(last_msg) or {}).get("final_answer","Unknown error occured")
         last_msg = resolve_tags(__msg_content)
         pattern = re.compile(r'<(text|chart)>(.*?)</\1>', re.DOTALL)
         msg = []
@@ -85,17 +89,12 @@ def create_response(last_msg, extra_context):
     return resp
 
 
-def check_dataset(session_id):
+@trace_call
+async def check_dataset(session_id, prefetched_metadata=NOT_FETCHED):
     """Checks if a dataset is present for that Chat"""
     try:
-        check = False
-        with session_scope() as session:
-            check = session.query(
-                ChatThread.dataset_id
-            ).filter(
-                ChatThread.session_uuid == session_id,
-                ChatThread.is_active == True
-            ).all()
+        _metadata = await get_session_metadata(session_id, prefetched_metadata)
+        check = _metadata["has_dataset"]
 
         logger.info(f"Check dataset --> {check}")
 
@@ -120,36 +119,28 @@ def check_dataset(session_id):
         logger.exception(f"error in checking dataset info {e}")
     return dataset_context
 
-async def get_chat_context(key):
-    """ Loads the Chat Context """
+@trace_call
+async def get_chat_context(key, cached=NOT_FETCHED):
+    """ Loads the Chat Context, `cached` is the redis value when already read in a batch """
     prev_context = []
     try:
-        _redis_client = get_redis()
-        _context =  await _redis_client.get(key)
+        _context = await get_binary_redis().get(key) if cached is NOT_FETCHED else cached
         if _context:
-            logger.info("found previous context on redis")
-            prev_context = loads(_context)
-            prev_context = messages_from_dict(prev_context)
-            logger.info(f"prev context --> {prev_context}")
+            logger.info(f"found previous context on redis ({len(_context)} bytes)")
+            prev_context = decode_context(_context)
+            logger.debug(f"prev context --> {len(prev_context)} messages")
     except Exception as e:
         logger.info(f"error in getting context {e}")
     return prev_context
 
-def transform_context(context):
-    """ Transforms context to dump on Redis """
-    try:
-        transformed = [msg.dict() for msg in context]
-    except Exception as e:
-        logger.exception(f"error in transforming context {e}")
-        return []
-    return transformed
-
+@trace_call
 async def set_chat_context(llm_context, extra_context, key):
     """ Sets Context on Redis """
     try:
-        _redis = get_redis()
-        llm_context = transform_context(llm_context)
-        await _redis.set(key, dumps(llm_context))
+        _redis = get_binary_redis()
+        llm_context = await compact_context(llm_context)
+        # legacy json keys are rewritten in the configured codec version here
+        await _redis.set(key, get_context_codec().encode(llm_context))
         logger.info("Sucessfully set context on redis")
     except Exception as e:
         logger.exception(f"error in setting llm context {e}")
@@ -160,32 +151,80 @@ async def create_chat(request:Request):
     """ Creates a new Chat """
     try:
         session_id = request.state.session_id
-        resp = await asyncio.to_thread(add_chat_thread, session_id)
+        resp = await add_chat_thread(session_id)
+        await invalidate_session_metadata(session_id)
     except Exception as e:
         logger.exception(f"error in creating chat {e}")
         resp = {"message":"Unable to create a chat at the moment"}
     return resp
 
 
+async def prefetch_turn(session_id, context_key):
+    """
+    Reads the redis state of a chat turn (metadata cache, context) in one round trip
+    Returns:
+        (metadata replies, context value), NOT_FETCHED for reads that failed
+    """
+    try:
+        _metadata_commands = prefetch_commands(session_id)
+        replies = await batch(_metadata_commands + [("GET", context_key)], binary=True)
+        _metadata, _context = replies[:-1], replies[-1]
+        if any(isinstance(reply, Exception) for reply in _metadata):
+            _metadata = NOT_FETCHED
+        return _metadata, NOT_FETCHED if isinstance(_context, Exception) else _context
+    except Exception as e:
+        logger.exception(f"error in prefetching chat turn {e}")
+    return NOT_FETCHED, NOT_FETCHED
+
+
+async def build_chat_state(session_id, user_query):
+    """
+    Builds the initial graph state for a chat turn
+    Returns:
+        initial_state, preamble length (messages not to be stored), redis context key
+    """
+    _context_key = f"{session_id}_main_context"
+    _cached_metadata, _cached_context = await prefetch_turn(session_id, _context_key)
+    dataset_context = await check_dataset(session_id, _cached_metadata)
+    prev_context = await get_chat_context(_context_key, _cached_context)
+    preamble = [("system", MASTER_SYSTEM_PROMOPT)] + dataset_context + ONE_SHOT
+    llm_context = preamble + prev_context + [("user", user_query)]
+    initial_state = {"llm_context":llm_context , "extra_context":{}, "result_store":ResultStore(), "session_id":session_id,
+                     "budget":Budget(), "pending_sql":{}}
+    return initial_state, len(preamble), _context_key
+
+
 @router.post("/get-ai-resp")
 async def get_llm_resp(request:Request, background_tasks:BackgroundTasks ,data:QueryPayload):
     resp = {}
+    initial_state = None
 
     try:
         session_id = request.state.session_id
         user_query = data.user_query
         logger.info(f"uer query --> {user_query}")
-        dataset_context = await asyncio.to_thread(check_dataset, session_id)
-        logger.info(MASTER_SYSTEM_PROMOPT)
-        _context_key = f"{session_id}_main_context"
-        prev_context = await get_chat_context(_context_key)
-        llm_context = [("system", MASTER_SYSTEM_PROMOPT)] + dataset_context + ONE_SHOT + prev_context + [("user", user_query)]
-        initial_state = {"llm_context":llm_context , "extra_context":{}, "session_id":session_id}
+        initial_state, preamble_len, _context_key = await build_chat_state(session_id, user_query)
         chat_result = await run_graph(initial_state)
         llm_context = chat_result["llm_context"]
         extra_context = chat_result["extra_context"]
         resp = create_response(llm_context[-1], extra_context)
-        background_tasks.add_task(set_chat_context, llm_context[1:], extra_context, _context_key)
+        background_tasks.add_task(set_chat_context, llm_context[preamble_len:], extra_context, _context_key)
     except Exception as e:
         logger.exception(f"error in get llm resp {e}")
-    return resp
\ No newline at end of file
+    finally:
+        if initial_state:
+            initial_state["result_store"].close()
+    return resp
+
+
+@router.get("/dataset-job/{job_id}")
+async def dataset_job_status(request:Request, job_id:str):
+    """ Status / result of a dataset generation job """
+    try:
+        job = await get_job(job_id)
+        if not job or job["session_id"] != request.state.session_id:
+            return JSONResponse({"message":"job not found"}, status_code=404)
+        return job
+    except Exception as e:
+        logger.exception(f"error in getting dataset job {e}")
+    return {"message":"Unable to get job status at the moment"}
@@ -1,44 +1,114 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-import json
+from fastapi import APIRouter, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 import asyncio
-import os
+from copy import deepcopy
+from json import dumps
 from typing import Dict, List
 from src.main_logger import logger
-# from library.firebase_connect import firestore_client
+from src.data_models import QueryPayload
+from library.streaming import stream_graph, parse_ws_query
+from library.cache_connect import get_pubsub_redis
+from library.jobs import session_channel
+from services.chat import build_chat_state, create_response, set_chat_context, ERROR_RESPONSE
 
+stream_router = APIRouter()
 ws_connections: Dict[str, List[WebSocket]] = {}
 
 
-# async def websocket_endpoint(websocket: WebSocket, session_id: str):
-#     await websocket.accept()
+async def chat_events(session_id, user_query):
+    """
+    Streams a chat turn as (event, data) pairs, ends with a `response`
+    event holding the same payload as /get-ai-resp
+    """
+    resp = deepcopy(ERROR_RESPONSE)
+    initial_state = None
+    try:
+        logger.info(f"uer query (stream) --> {user_query}")
+        initial_state, preamble_len, _context_key = await build_chat_state(session_id, user_query)
+        async for event, data in stream_graph(initial_state):
+            if event != "result":
+                yield event, data
+                continue
+            chat_result = data["state"]
+            if not chat_result:
+                break
+            llm_context = chat_result["llm_context"]
+            extra_context = chat_result["extra_context"]
+            resp = create_response(llm_context[-1], extra_context)
+            yield "response", resp
+            await set_chat_context(llm_context[preamble_len:], extra_context, _context_key)
+            return
+    except Exception as e:
+        logger.exception(f"error in streaming chat {e}")
+    finally:
+        if initial_state:
+            initial_state["result_store"].close()
+    yield "response", resp
 
-#     if session_id not in ws_connections:
-#         ws_connections[session_id] = []
 
-#     ws_connections[session_id].append(websocket)
+def format_sse(event, data) -> str:
+    """ Formats a server sent event """
+    return f"event: {event}\ndata: {dumps(data, default=str)}\n\n"
 
-#     user_collection = firestore_client.collection(session_id)
 
+@stream_router.post("/stream-ai-resp")
+async def stream_llm_resp(request:Request, data:QueryPayload):
+    """ Streams the chat response as Server-Sent Events """
+    session_id = request.state.session_id
 
-#     def on_snapshot(col_snapshot, changes, read_time):
-#         for change in changes:
-#             if change.type.name in ("ADDED", "MODIFIED"):
-#                 data = change.document.to_dict()
-#                 asyncio.create_task(broadcast(session_id, json.dumps(data)))
+    async def _event_stream():
+        async for event, payload in chat_events(session_id, data.user_query):
+            yield format_sse(event, payload)
 
-#     # Start watching the collection
-#     query_watch = user_collection.on_snapshot(on_snapshot)
+    return StreamingResponse(_event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-#     try:
-#         while True:
-#             await websocket.receive_text()  # Keep connection alive
-#     except WebSocketDisconnect:
-#         ws_connections[session_id].remove(websocket)
 
+async def forward_session_events(websocket: WebSocket, session_id: str):
+    """ Pushes background events of a session (e.g. dataset jobs) to the websocket """
+    pubsub = get_pubsub_redis().pubsub()
+    await pubsub.subscribe(session_channel(session_id))
+    try:
+        async for message in pubsub.listen():
+            if message["type"] == "message":
+                await websocket.send_text(message["data"])
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
 
-# async def broadcast(user_id: str, message: str):
-#     for ws in ws_connections.get(user_id, []):
-#         try:
-#             await ws.send_text(message)
-#         except:
-#             logger.exception("error sending ws response")
\ No newline at end of file
+
+async def websocket_endpoint(websocket: WebSocket, session_id: str):
+    """ Chat over websocket, every text message is a user query """
+    await websocket.accept()
+    ws_connections.setdefault(session_id, []).append(websocket)
+    events_task = asyncio.create_task(forward_session_events(websocket, session_id))
+
+    try:
+        while True:
+            user_query = parse_ws_query(await websocket.receive_text())
+            if not user_query:
+                continue
+            async for event, payload in chat_events(session_id, user_query):
+                await websocket.send_text(dumps({"event": event, "data": payload}, default=str))
+    except WebSocketDisconnect:
+        logger.info(f"websocket disconnected {session_id=}")
+    finally:
+        events_task.cancel()
+        try:
+            await events_task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.exception(f"error in forwarding session events {e}")
+        ws_connections[session_id].remove(websocket)
+        if not ws_connections[session_id]:
+            ws_connections.pop(session_id, None)
+
+
+async def broadcast(session_id: str, message: str):
+    """ Sends a message to all websockets of a session """
+    for ws in ws_connections.get(session_id, []):
+        try:
+            await ws.send_text(message)
+        except Exception:
+            logger.exception("error sending ws response")
@@ -1,6 +1,8 @@
 from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
 from src.main_logger import logger
 from library.cache_connect import get_redis
+from library.tracing import get_trace
 
 util_router = APIRouter()
 
@@ -17,4 +19,17 @@ async def flush_redis(request:Request):
         logger.exception(f"error in flushing redis {e}")
         return {
             "message":"unable to flush redis"
-        }
\ No newline at end of file
+        }
+
+
+@util_router.get("/debug/trace/{request_id}")
+async def debug_trace(request:Request, request_id:str):
+    """ Span timeline of a recent request (request id from the X-Request-ID response header) """
+    spans = get_trace(request_id)
+    if spans is None:
+        return JSONResponse({"message":"trace not found"}, status_code=404)
+    _start = spans[0]["start_ns"]
+    return {
+        "request_id": request_id,
+        "spans": [{**_span, "offset_ms": round((_span["start_ns"] - _start) / 1_000_000, 3)} for _span in spans]
+    }
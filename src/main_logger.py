@@ -1,14 +1,95 @@
+import atexit
 import logging
+import queue
+import random
 import sys
+from json import dumps
+from logging.handlers import QueueHandler, QueueListener
+from src.common import get_config
+
+_log_config = get_config("logging") or {}
+
+LEVEL = _log_config.get("level", "INFO")
+JSON_LOGS = _log_config.get("json", True)
+MAX_FIELD_CHARS = _log_config.get("max_field_chars", 2000)
+DEBUG_SAMPLE_RATE = _log_config.get("debug_sample_rate", 0.1)
+QUEUE_SIZE = _log_config.get("queue_size", 10_000)
+# module (file name without .py) -> level, e.g. {"graph": "DEBUG", "cache_connect": "WARNING"}
+MODULE_LEVELS = {module: logging.getLevelName(level) for module, level in _log_config.get("module_levels", {}).items()}
+_BASE_LEVEL = logging.getLevelName(LEVEL)
+
+
+def truncate(value: str, limit: int = MAX_FIELD_CHARS) -> str:
+    """ Caps a log field, keeps the head and notes the dropped size """
+    if limit and len(value) > limit:
+        return f"{value[:limit]}... [truncated {len(value) - limit} chars]"
+    return value
+
+
+class ModuleLevelFilter(logging.Filter):
+    """ Per module levels on top of the logger level, debug lines are sampled """
+
+    def filter(self, record):
+        if record.levelno < MODULE_LEVELS.get(record.module, _BASE_LEVEL):
+            return False
+        if record.levelno == logging.DEBUG and DEBUG_SAMPLE_RATE < 1:
+            return random.random() < DEBUG_SAMPLE_RATE
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """ One json object per line """
+
+    def format(self, record):
+        _record = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "file": f"{record.filename}:{record.lineno}",
+            "msg": truncate(record.getMessage())
+        }
+        if record.exc_info:
+            _record["exc"] = self.formatException(record.exc_info)
+        return dumps(_record, ensure_ascii=False, default=str)
+
+
+class TruncatingFormatter(logging.Formatter):
+    """ Plain text formatter with a capped message """
+
+    def formatMessage(self, record):
+        record.message = truncate(record.message)
+        return super().formatMessage(record)
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """
+    Enqueues records for the listener thread. Only the message is resolved in the
+    calling thread, formatting and stdout writes happen on the listener thread.
+    Records are dropped when the queue is full instead of blocking the event loop.
+    """
+
+    def prepare(self, record):
+        record.msg = truncate(record.getMessage())
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
 
 
 logger = logging.getLogger("main logger")
-logger.setLevel(logging.DEBUG)
+# the logger lets through the lowest configured level, ModuleLevelFilter applies the rest
+logger.setLevel(min([_BASE_LEVEL, *MODULE_LEVELS.values()]))
 
-formatter = logging.Formatter(
-    "[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)d] [%(message)s]",
-    datefmt="%d-%m-%y %H:%M:%S"
-)
+if JSON_LOGS:
+    formatter = JsonFormatter()
+else:
+    formatter = TruncatingFormatter(
+        "[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)d] [%(message)s]",
+        datefmt="%d-%m-%y %H:%M:%S"
+    )
 
 
 console_handler = logging.StreamHandler(sys.stdout)
@@ -17,6 +98,12 @@ console_handler.setFormatter(formatter)
 
 
 if not logger.handlers:
-    logger.addHandler(console_handler)
+    _log_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    queue_handler = _NonBlockingQueueHandler(_log_queue)
+    queue_handler.addFilter(ModuleLevelFilter())
+    log_listener = QueueListener(_log_queue, console_handler, respect_handler_level=True)
+    log_listener.start()
+    atexit.register(log_listener.stop)
+    logger.addHandler(queue_handler)
 
 logger.propagate = False